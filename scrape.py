@@ -13,6 +13,11 @@ from pathlib import Path
 # manager = ScrapeManager(urltable_path=masterpath)
 # manager.deploy()
 
+# SCRAPE ONLY THE CAMPAIGNS ADDED OR CHANGED SINCE THE LAST SITEMAP COLLECTION
+# to_scrape_path, to_scrape_df = URLCollector().create_url_table(delta=True)
+# manager = ScrapeManager(urltable_path=to_scrape_path)
+# manager.deploy()
+
 
 tablepath = data_io.input_raw / "wayback_20210220" / "master_urls_table.csv"
 tablecolumn = "cleaned_url"
@@ -52,3 +57,9 @@ manager = ScrapeManager(
     urltable_path=tablepath, urltable_column=tablecolumn, savepath=savepath
 )
 manager.deploy(resume=True)
+
+# RE-PARSING CACHED PAGES AFTER A SCRAPER FIX
+# every page fetched by deploy() is kept in the html cache, re-scrape all of
+# them on every core without going back to the network
+# from src.scrapingtools.reparse import reparse
+# reparse(outpath=data_io.input_raw / "scrape_output" / "reparsed")
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+# siphash key of the campaign keys, fixed so keys are stable across runs and
+# can be stored next to the tables they were computed from (16 bytes)
+HASH_KEY = "gfm-campaign-key"
+
+
+def normalize_campaign_ids(campaign_ids):
+    """ the form campaign ids are compared in, stripped and lowercased like
+    gofundme treats them. Missing ids stay missing. """
+    campaign_ids = pd.Series(campaign_ids, dtype=object)
+    normalized = campaign_ids.astype(str).str.strip().str.lower()
+    return normalized.where(campaign_ids.notna())
+
+
+def _hash(normalized):
+    return (
+        pd.util.hash_pandas_object(normalized, index=False, hash_key=HASH_KEY)
+        .to_numpy()
+        .view(np.int64)
+    )
+
+
+def campaign_keys(*campaign_ids):
+    """ int64 key of every campaign id, one array per Series passed.
+
+    Ids are normalized then hashed, so comparing, joining and deduplicating
+    tables of campaigns runs on integers. All the Series passed are checked
+    together: two different normalized ids sharing a key raise a ValueError
+    instead of silently matching, so tables compared with each other should
+    be keyed in one call.
+    """
+    keys = [_hash(normalize_campaign_ids(ids)) for ids in campaign_ids]
+    # keys are a function of the ids, so only ids sharing a key with another
+    # id can have collided; only those are normalized again and compared
+    shared = pd.Series(np.concatenate(keys)).duplicated(keep=False).to_numpy()
+    if shared.any():
+        _check_collisions(campaign_ids, keys, shared)
+    return keys
+
+
+def _check_collisions(campaign_ids, keys, shared):
+    pairs = []
+    start = 0
+    for ids, ids_keys in zip(campaign_ids, keys):
+        ids_shared = shared[start : start + ids_keys.shape[0]]
+        start += ids_keys.shape[0]
+        if ids_shared.any():
+            pairs.append(
+                pd.DataFrame(
+                    {
+                        "key": ids_keys[ids_shared],
+                        "campaign_id": normalize_campaign_ids(
+                            np.asarray(ids, dtype=object)[ids_shared]
+                        ).to_numpy(),
+                    }
+                ).drop_duplicates()
+            )
+    pairs = pd.concat(pairs, ignore_index=True).drop_duplicates()
+    collided = pairs[pairs.key.duplicated(keep=False)].sort_values("key")
+    if not collided.empty:
+        raise ValueError(
+            "campaign ids share a key: "
+            + ", ".join(repr(c) for c in collided.campaign_id.head(10))
+        )
+
+
+def isin(campaign_ids, other_campaign_ids):
+    """ boolean array, True where a campaign id is one of other_campaign_ids
+    once both are normalized """
+    keys, other_keys = campaign_keys(campaign_ids, other_campaign_ids)
+    return pd.Series(keys).isin(other_keys).to_numpy()
+
+
+def drop_duplicate_campaigns(table, column):
+    """ table with only the first row of every campaign in column, compared
+    in normalized form """
+    (keys,) = campaign_keys(table[column])
+    return table[~pd.Series(keys).duplicated().to_numpy()]
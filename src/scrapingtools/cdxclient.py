@@ -0,0 +1,161 @@
+import asyncio
+import json
+import threading
+
+import aiohttp
+import pandas as pd
+
+from .utils import log_message as print
+from . import waybackinterface as wbi
+from . import metrics as metrics
+from . import ratecontrol as ratecontrol
+
+CDX_SEARCH_URL = "http://web.archive.org/cdx/search/cdx"
+CDX_HOST = ratecontrol.host_of(CDX_SEARCH_URL)
+MAX_CONCURRENCY = 8  # requests in flight
+MAX_PAGES = 20  # pages read of one paged search before it counts as failed
+
+
+def _split_resume_key(rows):
+    # with showResumeKey the output ends in an empty row and [resume key]
+    if len(rows) >= 2 and rows[-2] == [] and len(rows[-1]) == 1:
+        return rows[:-2], rows[-1][0]
+    return rows, None
+
+
+def search_results_from_json(text):
+    """ (search results, resume key of the next page or None) """
+    # first row of the cdx json output is the header
+    rows, resume_key = _split_resume_key(json.loads(text) if text.strip() else [])
+    if len(rows) <= 1:
+        return pd.DataFrame(columns=wbi.SEARCH_RESULT_HEADER), resume_key
+    search_results = pd.DataFrame(rows[1:], columns=rows[0])
+    search_results = search_results.sort_values(by="timestamp").reset_index(drop=True)
+    return search_results, resume_key
+
+
+class AsyncCDXClient(object):
+    """ Wayback CDX search client running on its own background event loop.
+
+    Every search shares one keep-alive aiohttp session, is paced by the shared
+    per host rate controller and limited to max_concurrency requests in
+    flight. The blocking search/search_many wrappers are safe to call from any
+    thread. A search that fails retry_max times returns None, so callers can
+    tell it apart from a url with no captures.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=MAX_CONCURRENCY,
+        timeout=wbi.TIMEOUT,
+        retry_max=wbi.RETRY_MAX,
+        max_pages=MAX_PAGES,
+    ):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retry_max = retry_max
+        self.max_pages = max_pages
+        self._loop = None
+        self._session = None
+        self._loop_lock = threading.Lock()
+
+    def _get_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="cdxclient", daemon=True
+                ).start()
+        return self._loop
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop()).result()
+
+    async def _get_session(self):
+        # created lazily so they bind to the client's event loop
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def _search(self, url_to_search, **params):
+        session = await self._get_session()
+        params = {
+            "url": url_to_search,
+            "matchType": "prefix",
+            "output": "json",
+            **params,
+        }
+        async with self._semaphore:
+            await asyncio.sleep(ratecontrol.CONTROLLER.reserve_delay(CDX_HOST))
+            print(f"Search for archives w query: {url_to_search}")
+            async with session.get(CDX_SEARCH_URL, params=params) as response:
+                ratecontrol.CONTROLLER.report_status(CDX_HOST, response.status)
+                response.raise_for_status()
+                text = await response.text(encoding="utf-8")
+        return search_results_from_json(text)
+
+    async def _asearch_page(self, url_to_search, **params):
+        for retry_count in range(self.retry_max):
+            if retry_count > 0:
+                print(f"request try {retry_count+1}")
+            try:
+                with metrics.span("wayback_search", url_to_search):
+                    return await self._search(url_to_search, **params)
+            except aiohttp.ClientResponseError as ee:
+                # already reported to the rate controller with its status
+                print(f"returned error: {str(ee)}")
+            except Exception as ee:
+                print(f"returned error: {str(ee)}")
+                ratecontrol.CONTROLLER.report(CDX_HOST, False)
+        print(f"failed to search {self.retry_max} times")
+        return None
+
+    async def asearch(self, url_to_search, page_size=None, **params):
+        """ search results of url_to_search, or None if the search failed.
+        With a page_size the captures are read page_size at a time following
+        the cdx resume keys, a search longer than max_pages pages fails """
+        if page_size is not None:
+            params = {**params, "limit": page_size, "showResumeKey": "true"}
+        pages = []
+        for _ in range(self.max_pages if page_size is not None else 1):
+            page = await self._asearch_page(url_to_search, **params)
+            if page is None:
+                return None
+            search_results, resume_key = page
+            pages.append(search_results)
+            if page_size is None or resume_key is None:
+                break
+            params["resumeKey"] = resume_key
+        else:
+            print(f"more than {self.max_pages} pages of captures of {url_to_search}")
+            return None
+        if len(pages) == 1:
+            return pages[0]
+        return (
+            pd.concat(pages, ignore_index=True, sort=False)
+            .sort_values(by="timestamp")
+            .reset_index(drop=True)
+        )
+
+    async def asearch_many(self, urls_to_search, **params):
+        return await asyncio.gather(
+            *[self.asearch(url, **params) for url in urls_to_search]
+        )
+
+    def search(self, url_to_search, **params):
+        return self._run(self.asearch(url_to_search, **params))
+
+    def search_many(self, urls_to_search, **params):
+        """ search every url concurrently, results are in the order of the input
+        with None for failed searches. params are extra cdx query parameters,
+        e.g. filter="statuscode:200" """
+        return self._run(self.asearch_many(urls_to_search, **params))
+
+    def close(self):
+        if self._session is not None:
+            self._run(self._session.close())
+            self._session = None
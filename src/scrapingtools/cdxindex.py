@@ -0,0 +1,403 @@
+import argparse
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .utils import log_message as print
+from . import utils as utils
+from . import waybackinterface as wbi
+from . import urlcleaning as uclean
+
+INDEX_DIRNAME = "cdx_index"
+INDEX_COLUMNS = ["timestamp", "original", "statuscode", "digest"]
+MISSING_STATUSCODE = -1  # cdx writes "-" for revisits and some redirects
+RUN_ROWS = 1000000  # captures sorted in memory at a time while building
+MERGE_BLOCK_ROWS = 100000  # captures read from every run per merge step
+RUNS_DIRNAME = "runs"
+# bumped whenever the keys change, older indexes have to be rebuilt
+INDEX_VERSION = 2
+# ids that start like a campaign name and hold no "&" or "%" come out of
+# clean_campaign_id unchanged unless they end in "."
+PLAIN_CAMPAIGN_ID = r"[A-Za-z0-9\-][^&%]*"
+
+
+def clean_campaign_id(campaign_id):
+    """ campaign_id cleaned like the cleaned_campaign_id of the wayback url
+    table (see wbi.drop_duplicate_wayback_url and
+    uclean.wayback_url_cleaning), the form the index is keyed on """
+    campaign_id = wbi.remove_special_char_in_beginning(campaign_id)
+    campaign_id = wbi.find_hidden_query_in_path(campaign_id)
+    campaign_id = wbi.remove_ending_period(campaign_id)
+    campaign_id = uclean.cut_percent_front(campaign_id)
+    return uclean.remove_percent_within(campaign_id)
+
+
+def index_keys(originals):
+    """ lowercased cleaned campaign ids of a Series of capture urls """
+    campaign_ids = wbi.extract_campaign_ids(originals)
+    plain = campaign_ids.str.fullmatch(PLAIN_CAMPAIGN_ID)
+    changes = ~plain | campaign_ids.str.endswith(".")
+    campaign_ids[changes] = [clean_campaign_id(x) for x in campaign_ids[changes]]
+    return campaign_ids.str.lower()
+
+
+def _read_captures(captures):
+    captures = captures.dropna(subset=["timestamp", "original"])
+    keys = index_keys(captures.original)
+    # urls without a campaign id, like the home page, are not indexed
+    captures, keys = captures[keys != ""], keys[keys != ""]
+    statuscodes = pd.to_numeric(captures.statuscode, errors="coerce")
+    return {
+        "key": keys.str.encode("utf-8").values.astype(bytes),
+        "timestamp": captures.timestamp.astype(np.int64).values,
+        "statuscode": statuscodes.fillna(MISSING_STATUSCODE).astype(np.int16).values,
+        "digest": captures.digest.fillna("").str.encode("ascii").values.astype(bytes),
+        "original": captures.original.str.encode("utf-8").values,
+    }
+
+
+def _write_run(captures, run_path):
+    # one sorted run of the external sort, laid out like the index itself
+    order = np.lexsort((captures["timestamp"], captures["key"]))
+    run_path.mkdir(parents=True)
+    for column in ("key", "timestamp", "statuscode", "digest"):
+        np.save(run_path / f"{column}.npy", captures[column][order])
+    originals = captures["original"][order]
+    lengths = np.fromiter(
+        (len(o) for o in originals), dtype=np.int64, count=originals.shape[0]
+    )
+    offsets = np.zeros(originals.shape[0] + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    np.save(run_path / "original_offsets.npy", offsets)
+    (run_path / "original.bin").write_bytes(b"".join(originals))
+
+
+def _write_runs(batch_fpaths, runs_path, run_rows):
+    run_paths = []
+    for fpath in batch_fpaths:
+        print(f"[cdxindex] Reading {Path(fpath).name}")
+        chunks = pd.read_csv(
+            fpath,
+            encoding="utf-8",
+            dtype=str,
+            usecols=lambda c: c in INDEX_COLUMNS,
+            chunksize=run_rows,
+        )
+        for chunk in chunks:
+            captures = _read_captures(chunk)
+            if captures["key"].shape[0] == 0:
+                continue
+            run_path = runs_path / f"run{len(run_paths):05d}"
+            _write_run(captures, run_path)
+            run_paths.append(run_path)
+    return run_paths
+
+
+class _Run(object):
+    """ a sorted run on disk, read front to back by the merge """
+
+    def __init__(self, run_path):
+        def _load(name):
+            return np.load(run_path / f"{name}.npy", mmap_mode="r")
+
+        self.key = _load("key")
+        self.timestamp = _load("timestamp")
+        self.statuscode = _load("statuscode")
+        self.digest = _load("digest")
+        self.original_offsets = _load("original_offsets")
+        self.original_blob = np.memmap(
+            run_path / "original.bin", dtype=np.uint8, mode="r"
+        )
+        self.n = self.key.shape[0]
+        self.pos = 0
+
+    def take(self, count):
+        start, stop = self.pos, self.pos + count
+        offsets = self.original_offsets[start : stop + 1]
+        blob = self.original_blob[offsets[0] : offsets[-1]].tobytes()
+        relative = offsets - offsets[0]
+        captures = {
+            "key": np.asarray(self.key[start:stop]),
+            "timestamp": np.asarray(self.timestamp[start:stop]),
+            "statuscode": np.asarray(self.statuscode[start:stop]),
+            "digest": np.asarray(self.digest[start:stop]),
+            "original": [
+                blob[relative[j] : relative[j + 1]] for j in range(count)
+            ],
+        }
+        self.pos = stop
+        return captures
+
+
+def _widest(arrays):
+    return np.dtype(f"S{max([a.dtype.itemsize for a in arrays] + [1])}")
+
+
+def _merge_runs(runs, index_path, block_rows):
+    """ k-way merge of the sorted runs into the index arrays, holding at most
+    block_rows captures of every run in memory """
+    n_captures = sum(run.n for run in runs)
+    key_dtype = _widest([run.key for run in runs])
+    digest_dtype = _widest([run.digest for run in runs])
+
+    def _open(name, dtype, shape):
+        return np.lib.format.open_memmap(
+            index_path / f"{name}.npy", mode="w+", dtype=dtype, shape=(shape,)
+        )
+
+    timestamp = _open("timestamp", np.int64, n_captures)
+    statuscode = _open("statuscode", np.int16, n_captures)
+    digest = _open("digest", digest_dtype, n_captures)
+    original_offsets = _open("original_offsets", np.int64, n_captures + 1)
+    original_offsets[0] = 0
+    # a campaign starts at most once per capture, trimmed once they are known
+    all_keys = _open("keys.tmp", key_dtype, n_captures)
+    all_starts = _open("starts.tmp", np.int64, n_captures + 1)
+
+    n_written, n_keys, last_key = 0, 0, None
+    with (index_path / "original.bin").open(mode="wb") as original_bin:
+        while True:
+            blocks = [
+                (run, min(run.pos + block_rows, run.n))
+                for run in runs
+                if run.pos < run.n
+            ]
+            if not blocks:
+                break
+            # captures up to the smallest last capture of the blocks that
+            # don't finish their run can't be preceded by any unread capture
+            bounds = [
+                (run.key[stop - 1], run.timestamp[stop - 1])
+                for run, stop in blocks
+                if stop < run.n
+            ]
+            bound = min(bounds) if bounds else None
+            parts = []
+            for run, stop in blocks:
+                count = stop - run.pos
+                if bound is not None:
+                    keys = run.key[run.pos : stop]
+                    timestamps = run.timestamp[run.pos : stop]
+                    # runs are sorted, so the captures within the bound are
+                    # a prefix of the block
+                    count = int(
+                        np.count_nonzero(
+                            (keys < bound[0])
+                            | ((keys == bound[0]) & (timestamps <= bound[1]))
+                        )
+                    )
+                if count > 0:
+                    parts.append(run.take(count))
+            keys = np.concatenate([part["key"].astype(key_dtype) for part in parts])
+            timestamps = np.concatenate([part["timestamp"] for part in parts])
+            order = np.lexsort((timestamps, keys))
+            stop = n_written + order.shape[0]
+            keys = keys[order]
+            timestamp[n_written:stop] = timestamps[order]
+            statuscode[n_written:stop] = np.concatenate(
+                [part["statuscode"] for part in parts]
+            )[order]
+            digest[n_written:stop] = np.concatenate(
+                [part["digest"].astype(digest_dtype) for part in parts]
+            )[order]
+            originals = [o for part in parts for o in part["original"]]
+            originals = [originals[i] for i in order]
+            lengths = np.fromiter(
+                (len(o) for o in originals), dtype=np.int64, count=len(originals)
+            )
+            original_offsets[n_written + 1 : stop + 1] = original_offsets[
+                n_written
+            ] + np.cumsum(lengths)
+            original_bin.write(b"".join(originals))
+
+            is_new = np.ones(keys.shape[0], dtype=bool)
+            is_new[1:] = keys[1:] != keys[:-1]
+            is_new[0] = last_key is None or keys[0] != last_key
+            new_rows = np.flatnonzero(is_new)
+            all_keys[n_keys : n_keys + new_rows.shape[0]] = keys[new_rows]
+            all_starts[n_keys : n_keys + new_rows.shape[0]] = n_written + new_rows
+            n_keys += new_rows.shape[0]
+            last_key = keys[-1]
+            n_written = stop
+    all_starts[n_keys] = n_captures
+
+    for name, array, n in (
+        ("keys", all_keys, n_keys),
+        ("starts", all_starts, n_keys + 1),
+    ):
+        trimmed = _open(name, array.dtype, n)
+        for start in range(0, n, block_rows):
+            stop = min(start + block_rows, n)
+            trimmed[start:stop] = array[start:stop]
+        trimmed.flush()
+        del trimmed
+    for array in (timestamp, statuscode, digest, original_offsets):
+        array.flush()
+    # the dump covers a range of years, captures outside it are not indexed
+    timestamp_range = (None, None)
+    if n_captures > 0:
+        timestamp_range = (int(timestamp.min()), int(timestamp.max()))
+    del timestamp, statuscode, digest, original_offsets, all_keys, all_starts
+    (index_path / "keys.tmp.npy").unlink()
+    (index_path / "starts.tmp.npy").unlink()
+    return n_keys, n_captures, timestamp_range
+
+
+def build_cdx_index(
+    batch_fpaths, index_path, run_rows=RUN_ROWS, block_rows=MERGE_BLOCK_ROWS
+):
+    """ compacts cdx query output batches (see WaybackURLCollector) into an
+    index directory of numpy arrays sorted by campaign id then timestamp.
+
+    Campaigns are keyed on their lowercased clean_campaign_id, the
+    cleaned_campaign_id of the url table. keys.npy holds every campaign id
+    once and starts.npy where its captures begin, the capture columns are
+    one array each, with the original urls stored as offsets into
+    original.bin. The batches are sorted out of core:
+    run_rows captures at a time are sorted into runs on disk, which are then
+    merged straight into the memory-mapped index.
+    """
+    index_path = utils.verify_pathtype(index_path)
+    index_path.mkdir(parents=True, exist_ok=True)
+    meta_fpath = index_path / "meta.json"
+    if meta_fpath.exists():
+        meta_fpath.unlink()  # the index is not readable until rebuilt
+    runs_path = index_path / RUNS_DIRNAME
+    if runs_path.exists():
+        shutil.rmtree(runs_path)  # left by a build that did not finish
+    try:
+        run_paths = _write_runs(batch_fpaths, runs_path, run_rows)
+        print(f"[cdxindex] Merging {len(run_paths)} sorted runs")
+        n_campaigns, n_captures, timestamp_range = _merge_runs(
+            [_Run(run_path) for run_path in run_paths], index_path, block_rows
+        )
+    finally:
+        if runs_path.exists():
+            shutil.rmtree(runs_path)
+    meta = {
+        "version": INDEX_VERSION,
+        "n_campaigns": int(n_campaigns),
+        "n_captures": int(n_captures),
+        "first_timestamp": timestamp_range[0],
+        "last_timestamp": timestamp_range[1],
+    }
+    meta_fpath.write_text(json.dumps(meta), encoding="utf-8")
+    print(
+        f"[cdxindex] Indexed {meta['n_captures']} captures of"
+        + f" {meta['n_campaigns']} campaigns in {index_path}"
+    )
+    return index_path
+
+
+class CDXIndex(object):
+    """ Read side of build_cdx_index, looks up the captures of a campaign id
+    with a binary search over the memory-mapped arrays.
+
+    The index only holds the captures of the dump it was built from, up to
+    last_timestamp: campaigns missing from it still have to be searched
+    online, and so do the captures of indexed ones after last_timestamp.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = utils.verify_pathtype(index_path)
+        meta_fpath = self.index_path / "meta.json"
+        if not meta_fpath.exists():
+            raise ValueError(
+                f"{self.index_path} is not a cdx index, see build_cdx_index"
+            )
+        meta = json.loads(meta_fpath.read_text(encoding="utf-8"))
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(
+                f"{self.index_path} was built by an older version,"
+                + " rebuild it with build_cdx_index"
+            )
+        self.last_timestamp = meta["last_timestamp"]
+
+        def _load(name):
+            return np.load(self.index_path / f"{name}.npy", mmap_mode="r")
+
+        self.keys = _load("keys")
+        self.starts = _load("starts")
+        self.timestamp = _load("timestamp")
+        self.statuscode = _load("statuscode")
+        self.digest = _load("digest")
+        self.original_offsets = _load("original_offsets")
+        original_fpath = self.index_path / "original.bin"
+        self.original_blob = (
+            np.memmap(original_fpath, dtype=np.uint8, mode="r")
+            if original_fpath.stat().st_size > 0
+            else np.zeros(0, dtype=np.uint8)
+        )
+
+    def __len__(self):
+        return self.keys.shape[0]
+
+    def __contains__(self, campaign_id):
+        return self._find(campaign_id) is not None
+
+    def _find_key(self, key):
+        key = key.lower().encode("utf-8")
+        if len(self) == 0 or len(key) > self.keys.dtype.itemsize:
+            return None
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self) and self.keys[i] == key:
+            return i
+        return None
+
+    def _find(self, campaign_id):
+        # ids of the url table are cleaned already, raw ids are cleaned here
+        campaign_id = str(campaign_id)
+        i = self._find_key(campaign_id)
+        if i is None:
+            i = self._find_key(clean_campaign_id(campaign_id))
+        return i
+
+    def lookup(self, campaign_id):
+        """ returns the captures of a campaign, raw or cleaned id, as search
+        results sorted by timestamp, or None if the campaign is not in the
+        index and has to be searched online """
+        i = self._find(campaign_id)
+        if i is None:
+            return None
+        start, stop = int(self.starts[i]), int(self.starts[i + 1])
+        offsets = self.original_offsets[start : stop + 1]
+        originals = [
+            self.original_blob[offsets[j] : offsets[j + 1]].tobytes().decode("utf-8")
+            for j in range(stop - start)
+        ]
+        statuscodes = self.statuscode[start:stop].astype(str)
+        statuscodes[self.statuscode[start:stop] == MISSING_STATUSCODE] = "-"
+        search_results = pd.DataFrame(
+            {
+                "timestamp": self.timestamp[start:stop].astype(str),
+                "original": originals,
+                "statuscode": statuscodes,
+                "digest": np.char.decode(np.asarray(self.digest[start:stop]), "ascii"),
+            }
+        )
+        return search_results.reindex(columns=wbi.SEARCH_RESULT_HEADER)
+
+    def lookup_many(self, campaign_ids):
+        """ returns {lowercased campaign id: search results} for the ids
+        in the index """
+        indexed = {}
+        for campaign_id in set(str(c).lower() for c in campaign_ids):
+            search_results = self.lookup(campaign_id)
+            if search_results is not None:
+                indexed[campaign_id] = search_results
+        return indexed
+
+
+if __name__ == "__main__":
+    # python -m src.scrapingtools.cdxindex path/to/wayback_YYYYMMDD/query_output
+    parser = argparse.ArgumentParser()
+    parser.add_argument("query_output_dir", type=Path)
+    parser.add_argument("--index_path", type=Path, default=None)
+    args = parser.parse_args()
+
+    batch_fpaths = sorted(args.query_output_dir.glob("wayback_query_output_batch*.csv"))
+    index_path = args.index_path or (args.query_output_dir.parent / INDEX_DIRNAME)
+    build_cdx_index(batch_fpaths, index_path)
@@ -0,0 +1,76 @@
+import os
+import struct
+
+# one record per checkpoint: (url table index of the last row written, size of
+# the output file once it was written)
+RECORD = struct.Struct("<qq")
+
+
+class CheckpointJournal(object):
+    """ Append-only journal of the rows written to one output file.
+
+    A record is only appended after the rows it covers are fsynced to the
+    output, so the last record is always a consistent checkpoint: resuming
+    truncates the output to the recorded size, dropping the rows written
+    after it, and carries on after the recorded index.
+    """
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self._file = None
+
+    def exists(self):
+        return self.fpath.exists()
+
+    def last(self):
+        """ returns the last (index, output size) record or None, reading
+        only the end of the journal """
+        if not self.fpath.exists():
+            return None
+        with self.fpath.open(mode="rb") as journal:
+            # a crash can leave a partial record at the end, ignore it
+            n_records = journal.seek(0, os.SEEK_END) // RECORD.size
+            if n_records == 0:
+                return None
+            journal.seek((n_records - 1) * RECORD.size)
+            return RECORD.unpack(journal.read(RECORD.size))
+
+    def open(self, new=False):
+        if new:
+            self._file = self.fpath.open(mode="wb")
+            return
+        self._file = self.fpath.open(mode="ab")
+        size = self._file.tell()
+        if size % RECORD.size != 0:
+            self._file.truncate(size - size % RECORD.size)
+
+    def record(self, index, output_size):
+        self._file.write(RECORD.pack(index, output_size))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def commit_rows(outfile, journal, index):
+    """ makes the rows written to outfile durable, then journals index, the
+    last of them """
+    outfile.flush()
+    os.fsync(outfile.fileno())
+    journal.record(index, outfile.tell())
+
+
+def rollback_output(save_fullpath, journal):
+    """ truncates an output file to its last checkpoint and returns the last
+    journaled index, or None if nothing was journaled """
+    last = journal.last()
+    if last is None:
+        return None
+    index, output_size = last
+    with save_fullpath.open(mode="r+b") as outfile:
+        if outfile.seek(0, os.SEEK_END) > output_size:
+            outfile.truncate(output_size)
+    return index
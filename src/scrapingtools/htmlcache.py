@@ -0,0 +1,178 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from .utils import log_message as print
+from . import utils as utils
+from .seleniumcontainer import AttrDict
+
+from .. import data_io
+
+CACHE_PATH = data_io.input_raw / "html_cache"
+MAX_CACHE_BYTES = 20 * 1024 ** 3  # 20 GiB of compressed html
+EVICT_TO = 0.9  # evict down to this fraction of max_bytes
+PRESENT_MAX_AGE = 30 * 24 * 3600  # seconds, live pages change, snapshots don't
+WAYBACK_URL_PATTERN = re.compile(r"^https?://web\.archive\.org/web/(\d+)[^/]*/(.*)$")
+
+
+def cache_address(url):
+    """ splits a wayback url into (original url, timestamp),
+    any other url is a live page with timestamp None """
+    match = WAYBACK_URL_PATTERN.match(url)
+    if match is None:
+        return url, None
+    return match.group(2), match.group(1)
+
+
+def _atomic_write(fpath, data):
+    tmp_fpath = fpath.with_name(f"{fpath.name}.{threading.get_ident()}.tmp")
+    tmp_fpath.write_bytes(data)
+    tmp_fpath.replace(fpath)
+
+
+class HTMLCache(object):
+    """ On-disk cache of fetched campaign pages.
+
+    Pages are stored gzipped under the sha256 of their html in objects/, so
+    identical snapshots are kept once. keys/ maps each (url, wayback
+    timestamp) address to the digest of the page fetched there. Once the
+    cache outgrows max_bytes the least recently used pages are evicted.
+    """
+
+    def __init__(
+        self, path=CACHE_PATH, max_bytes=MAX_CACHE_BYTES, present_max_age=PRESENT_MAX_AGE
+    ):
+        self.path = utils.verify_pathtype(path)
+        self.objects_path = self.path / "objects"
+        self.keys_path = self.path / "keys"
+        self.objects_path.mkdir(parents=True, exist_ok=True)
+        self.keys_path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.present_max_age = present_max_age
+        self._lock = threading.Lock()
+        self._size = None  # summed on the first put, readers never need it
+
+    def _iter_object_fpaths(self):
+        return self.objects_path.glob("*/*.html.gz")
+
+    def _iter_object_stats(self):
+        for object_fpath in self._iter_object_fpaths():
+            try:
+                yield object_fpath, object_fpath.stat()
+            except FileNotFoundError:
+                continue  # evicted while listing
+
+    def _key_fpath(self, url, timestamp):
+        address = f"{timestamp or 'present'} {url}"
+        digest = hashlib.sha256(address.encode("utf-8")).hexdigest()
+        return self.keys_path / digest[:2] / f"{digest}.json"
+
+    def _object_fpath(self, digest):
+        return self.objects_path / digest[:2] / f"{digest}.html.gz"
+
+    def _read_entry(self, key_fpath):
+        try:
+            return json.loads(key_fpath.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _get_size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(st.st_size for _, st in self._iter_object_stats())
+            return self._size
+
+    @staticmethod
+    def _touch(object_fpath):
+        """ marks an object as recently used, False if it is not there """
+        try:
+            os.utime(object_fpath)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def load(self, entry, touch=True):
+        object_fpath = self._object_fpath(entry["digest"])
+        try:
+            html = gzip.decompress(object_fpath.read_bytes()).decode("utf-8")
+        except FileNotFoundError:
+            return None  # evicted
+        if touch and not self._touch(object_fpath):
+            return None  # evicted since it was read
+        campaign_page = AttrDict()
+        campaign_page.url = entry["requested_url"]
+        campaign_page.text = html
+        return campaign_page
+
+    def get(self, url):
+        """ returns the cached page for url or None """
+        original_url, timestamp = cache_address(url)
+        entry = self._read_entry(self._key_fpath(original_url, timestamp))
+        if entry is None:
+            return None
+        if (
+            timestamp is None
+            and self.present_max_age is not None
+            and time.time() - entry["stored_at"] > self.present_max_age
+        ):
+            return None
+        return self.load(entry)
+
+    def put(self, campaign_page):
+        self._get_size()
+        data = campaign_page.text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        object_fpath = self._object_fpath(digest)
+        # an object evicted by another worker is written again
+        if not self._touch(object_fpath):
+            object_fpath.parent.mkdir(exist_ok=True)
+            compressed = gzip.compress(data)
+            _atomic_write(object_fpath, compressed)
+            with self._lock:
+                self._size += len(compressed)
+        original_url, timestamp = cache_address(campaign_page.url)
+        entry = {
+            "requested_url": campaign_page.url,
+            "url": original_url,
+            "timestamp": timestamp,
+            "digest": digest,
+            "stored_at": time.time(),
+        }
+        key_fpath = self._key_fpath(original_url, timestamp)
+        key_fpath.parent.mkdir(exist_ok=True)
+        _atomic_write(key_fpath, json.dumps(entry).encode("utf-8"))
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        self._get_size()
+        with self._lock:
+            if self._size <= self.max_bytes:
+                return
+            print(f"[htmlcache] evicting pages, cache holds {self._size} bytes")
+            object_stats = sorted(
+                self._iter_object_stats(), key=lambda x: x[1].st_mtime
+            )
+            # recounted from the listing, objects other processes evicted or
+            # wrote since the size was summed would leave it off
+            self._size = sum(stat.st_size for _, stat in object_stats)
+            for object_fpath, stat in object_stats:
+                if self._size <= self.max_bytes * EVICT_TO:
+                    break
+                try:
+                    object_fpath.unlink()
+                except FileNotFoundError:
+                    pass  # evicted by another process
+                self._size -= stat.st_size
+        # keys/ entries of evicted pages are left behind and read as misses
+
+    def iter_entries(self):
+        """ yields the entry of every cached address, see load() for its page """
+        for key_fpath in self.keys_path.glob("*/*.json"):
+            entry = self._read_entry(key_fpath)
+            if entry is not None:
+                yield entry
@@ -0,0 +1,64 @@
+import argparse
+import requests
+from requests.adapters import HTTPAdapter
+from .utils import log_message as print
+from . import metrics as metrics
+from . import ratecontrol as ratecontrol
+from .seleniumcontainer import AttrDict
+
+TIMEOUT = 30  # seconds
+POOL_MAXSIZE = 10  # keep-alive connections per host
+USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36"
+)
+
+
+class HTTPContainer(object):
+    """ Plain-HTTP fetcher sharing one pool of keep-alive connections.
+
+    Returns pages in the same shape as RendererContainer.render, but never runs
+    javascript, so it is only good enough for pages that carry their data in
+    the served html (e.g. the window.initialState script).
+    """
+
+    def __init__(self, pool_maxsize=POOL_MAXSIZE, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"User-Agent": USER_AGENT})
+
+    def fetch(self, url):
+        print(f"[httpcontainer] Requesting {url}")
+        host = ratecontrol.host_of(url)
+        ratecontrol.CONTROLLER.reserve(host)
+        try:
+            with metrics.span("http_fetch", url):
+                response = self.session.get(url, timeout=self.timeout)
+        except Exception as e:
+            print("[httpcontainer] " + str(e))
+            ratecontrol.CONTROLLER.report(host, False)
+            return None
+        ratecontrol.CONTROLLER.report_status(host, response.status_code)
+        if response.status_code != 200:
+            print(f"[httpcontainer] http status code {response.status_code}")
+            return None
+        campaign_page = AttrDict()
+        campaign_page.url = url
+        campaign_page.text = response.text
+        return campaign_page
+
+    def close(self):
+        self.session.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("url", type=str)
+    args = parser.parse_args()
+
+    page = HTTPContainer().fetch(args.url)
+    print(page)
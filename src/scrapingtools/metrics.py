@@ -0,0 +1,104 @@
+import argparse
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+from .utils import log_message as print
+from . import utils as utils
+
+METRICS_FILENAME = "scrape_metrics.jsonl"
+QUANTILES = (0.5, 0.99)
+
+# recorder of the running code, set with recording; spans are dropped while None
+_RECORDER = contextvars.ContextVar("metrics_recorder", default=None)
+
+
+class SpanRecorder(object):
+    """ Appends one json line per timed span to a local file, shared by every
+    thread of the process """
+
+    def __init__(self, path):
+        self.path = utils.verify_pathtype(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # line buffered, so a crash loses at most the span being written
+        self._file = self.path.open(mode="a", encoding="utf-8", buffering=1)
+
+    def record(self, stage, start, duration, url=None, ok=True):
+        line = json.dumps(
+            {
+                "stage": stage,
+                "url": url,
+                "start": start,
+                "duration": duration,
+                "ok": ok,
+                "thread": threading.current_thread().name,
+            }
+        )
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+@contextmanager
+def recording(recorder):
+    """ records the spans of the with block to recorder, or drops them if it
+    is None. Threads started inside only record if they run in a copy of the
+    context, see contextvars.copy_context """
+    token = _RECORDER.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _RECORDER.reset(token)
+
+
+@contextmanager
+def span(stage, url=None):
+    """ times the body of a with block as one span of stage """
+    recorder = _RECORDER.get()
+    if recorder is None:
+        yield
+        return
+    start, t0 = time.time(), time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        recorder.record(stage, start, time.perf_counter() - t0, url=url, ok=ok)
+
+
+def summarize(path):
+    """ count, failures, p50, p99 and total seconds of every stage """
+    spans = pd.read_json(path, lines=True)
+    if spans.empty:
+        return pd.DataFrame()
+    by_stage = spans.groupby("stage").duration
+    summary = pd.DataFrame(
+        {
+            "count": by_stage.size(),
+            "failed": (~spans.ok.astype(bool)).groupby(spans.stage).sum(),
+            **{f"p{int(q * 100)}": by_stage.quantile(q) for q in QUANTILES},
+            "total": by_stage.sum(),
+        }
+    )
+    return summary.sort_values("total", ascending=False)
+
+
+if __name__ == "__main__":
+    # python -m src.scrapingtools.metrics path/to/scrape_output/scrape_metrics.jsonl
+    parser = argparse.ArgumentParser()
+    parser.add_argument("metrics_path", type=Path)
+    args = parser.parse_args()
+
+    summary = summarize(args.metrics_path)
+    with pd.option_context("display.float_format", "{:.4f}".format):
+        print("\n" + summary.to_string())
@@ -0,0 +1,244 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import lxml.etree
+import lxml.html
+from bs4 import BeautifulSoup
+
+from .utils import log_message as print
+from . import scrapers as scrapers
+from . import metrics as metrics
+
+PARSER_BACKEND = "bs4"
+PARSER_BACKENDS = ("bs4", "lxml")
+# attributes BeautifulSoup splits on whitespace into a list of values
+MULTI_VALUED_ATTRIBUTES = ("class", "accesskey", "dropzone", "rel", "rev", "headers")
+# BeautifulSoup leaves the contents of these tags out of .text
+NON_TEXT_TAGS = ("script", "style", "template")
+# BeautifulSoup keeps whitespace-only strings as they are only inside these
+PRESERVE_WHITESPACE_TAGS = ("pre", "textarea")
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+
+def _bs4_string(text, parent):
+    # outside pre and textarea BeautifulSoup collapses a string of only ascii
+    # whitespace to one newline, or one space if it has no newline
+    if text.strip(ASCII_SPACES):
+        return text
+    if parent.tag in PRESERVE_WHITESPACE_TAGS or any(
+        ancestor.tag in PRESERVE_WHITESPACE_TAGS for ancestor in parent.iterancestors()
+    ):
+        return text
+    return "\n" if "\n" in text else " "
+
+
+def _iter_strings(element, recursive=True, text_only=True):
+    """ the strings under element as BeautifulSoup splits them, in document
+    order. text_only leaves out comments and the contents of NON_TEXT_TAGS
+    like .text does """
+    if element.text and not (text_only and element.tag in NON_TEXT_TAGS):
+        yield _bs4_string(element.text, element)
+    for child in element:
+        if isinstance(child.tag, str):
+            if recursive:
+                yield from _iter_strings(child, recursive, text_only)
+        elif not text_only and child.tag is lxml.etree.Comment and child.text:
+            yield child.text
+        if child.tail:
+            yield _bs4_string(child.tail, element)
+
+
+def _matches(value, pattern):
+    if pattern is None:
+        return value is None
+    if pattern is True:
+        return value is not None
+    if callable(pattern) and not hasattr(pattern, "search"):
+        return pattern(value)
+    if isinstance(pattern, (list, tuple, set)):
+        return any(_matches(value, item) for item in pattern)
+    return scrapers._attr_matches(value, pattern)
+
+
+def _name_matches(wrapped, name):
+    # functions passed as a name get the tag, like in BeautifulSoup
+    if callable(name) and not hasattr(name, "search"):
+        return name(wrapped)
+    return _matches(wrapped.name, name)
+
+
+class LxmlElement(object):
+    """ Wraps an lxml element in the parts of the BeautifulSoup Tag api that
+    the scrape_url_* functions use, so they run unchanged on an lxml tree """
+
+    __slots__ = ("element",)
+
+    def __init__(self, element):
+        self.element = element
+
+    @property
+    def name(self):
+        return self.element.tag
+
+    def get(self, attr, default=None):
+        value = self.element.get(attr)
+        if value is None:
+            return default
+        if attr in MULTI_VALUED_ATTRIBUTES:
+            return value.split()
+        return value
+
+    @property
+    def text(self):
+        if self.element.tag in NON_TEXT_TAGS:
+            # only nested scripts and styles are left out, asked directly
+            # BeautifulSoup returns their contents
+            return "".join(_iter_strings(self.element, text_only=False))
+        return "".join(_iter_strings(self.element))
+
+    @property
+    def string(self):
+        element = self.element
+        if len(element) == 0:
+            return _bs4_string(element.text, element) if element.text else None
+        if len(element) == 1 and not element.text and not element[0].tail:
+            return LxmlElement(element[0]).string
+        return None
+
+    def find_all(
+        self,
+        name=None,
+        attrs={},
+        recursive=True,
+        string=None,
+        limit=None,
+        **kwargs,
+    ):
+        """ BeautifulSoup's find_all: remaining keyword arguments filter on
+        attributes, class_ standing for class and text for string """
+        attrs = dict(attrs)
+        if "text" in kwargs:
+            string = kwargs.pop("text")
+        if "class_" in kwargs:
+            attrs["class"] = kwargs.pop("class_")
+        attrs.update(kwargs)
+        if string is not None and name is None and not attrs:
+            # a string on its own finds the matching text nodes, not tags
+            results = [
+                text
+                for text in _iter_strings(self.element, recursive, text_only=False)
+                if _matches(text, string)
+            ]
+            return results[:limit] if limit else results
+        if recursive:
+            elements = self.element.iterdescendants()
+        else:
+            elements = self.element.iterchildren()
+        results = []
+        for element in elements:
+            if not isinstance(element.tag, str):
+                continue
+            wrapped = LxmlElement(element)
+            if name is not None and not _name_matches(wrapped, name):
+                continue
+            if not all(
+                _matches(wrapped.get(attr), value) for attr, value in attrs.items()
+            ):
+                continue
+            if string is not None and not _matches(wrapped.string, string):
+                continue
+            results.append(wrapped)
+            if limit and len(results) >= limit:
+                break
+        return results
+
+    findChildren = find_all
+
+    def find(self, name=None, attrs={}, **kwargs):
+        results = self.find_all(name, attrs, **kwargs)
+        return results[0] if results else None
+
+
+class LxmlPageIndex(scrapers.PageIndex):
+    """ PageIndex over a tree built by lxml's C parser instead of BeautifulSoup """
+
+    def __init__(self, html, selectors):
+        if not html.strip():
+            html = "<html></html>"  # lxml refuses empty documents
+        parser = lxml.html.HTMLParser(encoding="utf-8")
+        root = lxml.html.document_fromstring(html.encode("utf-8"), parser=parser)
+        super(LxmlPageIndex, self).__init__(LxmlElement(root), selectors)
+
+    def _iter_tags(self):
+        for element in self.soup.element.iter():
+            if isinstance(element.tag, str):
+                yield LxmlElement(element)
+
+
+def parse_page(html, years, backend=PARSER_BACKEND):
+    """ parses html into a PageIndex for the scrapers of the given years """
+    selectors = scrapers.era_selectors(years)
+    if backend == "bs4":
+        with metrics.span("parse_bs4"):
+            return scrapers.PageIndex(BeautifulSoup(html, features="lxml"), selectors)
+    elif backend == "lxml":
+        with metrics.span("parse_lxml"):
+            return LxmlPageIndex(html, selectors)
+    raise ValueError(f"unknown parser backend {backend}, use one of {PARSER_BACKENDS}")
+
+
+def compare_backends(html, url, years=tuple(scrapers.ERA_SCRAPERS)):
+    """ scrapes html with every backend and returns the fields that differ from
+    the bs4 backend as (year, field, bs4 value, other backend, other value) """
+    results = {
+        backend: scrapers.scrape_url_eras(parse_page(html, years, backend), url, years)
+        for backend in PARSER_BACKENDS
+    }
+    mismatches = []
+    for backend in PARSER_BACKENDS[1:]:
+        for year in years:
+            expected, actual = results["bs4"][year], results[backend][year]
+            for field, value in expected.items():
+                if actual.get(field) != value:
+                    mismatches.append((year, field, value, backend, actual.get(field)))
+    return mismatches
+
+
+def time_backends(html, url, years=tuple(scrapers.ERA_SCRAPERS), repeat=5):
+    timings = {}
+    for backend in PARSER_BACKENDS:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            scrapers.scrape_url_eras(parse_page(html, years, backend), url, years)
+        timings[backend] = (time.perf_counter() - start) / repeat
+    return timings
+
+
+if __name__ == "__main__":
+    # parity check of the parser backends over a folder of saved html fixtures
+    # python -m src.scrapingtools.parsers path/to/fixtures
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fixture_dir", type=Path)
+    parser.add_argument("--timing", action="store_true")
+    args = parser.parse_args()
+
+    n_failed = 0
+    fixtures = sorted(args.fixture_dir.glob("*.html"))
+    for fixture in fixtures:
+        html = fixture.read_text(encoding="utf-8")
+        mismatches = compare_backends(html, fixture.stem)
+        if mismatches:
+            n_failed += 1
+        for year, field, expected, backend, actual in mismatches:
+            print(f"{fixture.name} {year} {field}: bs4={expected!r} {backend}={actual!r}")
+        if args.timing:
+            timings = time_backends(html, fixture.stem)
+            print(
+                fixture.name
+                + " "
+                + " ".join(f"{k}={v * 1000:.1f}ms" for k, v in timings.items())
+            )
+    print(f"{len(fixtures) - n_failed}/{len(fixtures)} fixtures match across backends")
+    sys.exit(1 if n_failed else 0)
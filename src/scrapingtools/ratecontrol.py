@@ -0,0 +1,123 @@
+import re
+import threading
+import time
+import urllib.parse as up
+
+from .utils import log_message as print
+
+INITIAL_RATE = 1.0  # requests per second
+MIN_RATE = 1 / 60  # a struggling host still gets a request every minute
+MAX_RATE = 10.0  # requests per second
+ADDITIVE_INCREASE = 0.05  # requests per second gained per healthy response
+MULTIPLICATIVE_DECREASE = 0.5  # rate kept after a throttled or failed request
+# hosts that start or top out elsewhere, as (initial rate, max rate)
+HOST_LIMITS = {
+    "web.archive.org": (1.0, 8.0),
+    "www.gofundme.com": (1.0, 4.0),
+    "api.mapbox.com": (2.0, 10.0),
+    "geo.fcc.gov": (2.0, 10.0),
+}
+
+
+_SCHEME = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*://")
+
+
+def host_of(url):
+    # wayback urls embed the scheme of the archived url in their path
+    if not _SCHEME.match(url):
+        url = "http://" + url
+    return (up.urlsplit(url).hostname or "").lower()
+
+
+def is_throttled(status_code):
+    # too many requests or the server struggling, anything else is the
+    # host answering normally even if the page is missing
+    return status_code == 429 or status_code >= 500
+
+
+class HostRate(object):
+    __slots__ = ("rate", "max_rate", "next_slot")
+
+    def __init__(self, rate, max_rate):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.next_slot = time.monotonic()
+
+
+class RateController(object):
+    """ Additive-increase multiplicative-decrease request pacing per host.
+
+    Every request first reserves a slot with its host, slots are 1/rate
+    seconds apart. Healthy responses raise the rate by ADDITIVE_INCREASE up to
+    the host's max rate; a 429, a 5xx or a failed request cuts it by
+    MULTIPLICATIVE_DECREASE down to MIN_RATE and pushes back the next slot,
+    which is what paces retries. Thread safe, and the async clients use
+    reserve_delay to wait on their own event loop.
+    """
+
+    def __init__(
+        self,
+        initial_rate=INITIAL_RATE,
+        min_rate=MIN_RATE,
+        max_rate=MAX_RATE,
+        increase=ADDITIVE_INCREASE,
+        decrease=MULTIPLICATIVE_DECREASE,
+        host_limits=HOST_LIMITS,
+    ):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.host_limits = dict(host_limits)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        # called with the lock held
+        if host not in self._hosts:
+            initial_rate, max_rate = self.host_limits.get(
+                host, (self.initial_rate, self.max_rate)
+            )
+            self._hosts[host] = HostRate(initial_rate, max_rate)
+        return self._hosts[host]
+
+    def rate(self, host):
+        with self._lock:
+            return self._host(host).rate
+
+    def reserve_delay(self, host):
+        """ reserves the next request slot of host and returns the seconds to
+        wait before sending the request """
+        with self._lock:
+            host_rate = self._host(host)
+            now = time.monotonic()
+            slot = max(now, host_rate.next_slot)
+            host_rate.next_slot = slot + 1 / host_rate.rate
+        return slot - now
+
+    def reserve(self, host):
+        delay = self.reserve_delay(host)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def report(self, host, ok):
+        with self._lock:
+            host_rate = self._host(host)
+            if ok:
+                host_rate.rate = min(host_rate.max_rate, host_rate.rate + self.increase)
+                return
+            host_rate.rate = max(self.min_rate, host_rate.rate * self.decrease)
+            host_rate.next_slot = max(
+                host_rate.next_slot, time.monotonic() + 1 / host_rate.rate
+            )
+            rate = host_rate.rate
+        print(f"[ratecontrol] backing off {host} to {rate:.3f} requests/sec")
+
+    def report_status(self, host, status_code):
+        self.report(host, not is_throttled(status_code))
+
+
+# shared by every fetcher of the process
+CONTROLLER = RateController()
@@ -1,5 +1,5 @@
-import time
 from .utils import log_message as print
+from . import ratecontrol as ratecontrol
 import argparse
 from sys import platform
 
@@ -77,7 +77,6 @@ class WebkitRenderer(QWebEnginePage):
 
 RETRY_MAX = 5  # times
 TIMEOUT = 150  # seconds
-SLEEP = 30  # seconds
 
 
 class RendererContainer(object):
@@ -97,18 +96,22 @@ class RendererContainer(object):
         retry = True
         retry_count = 0
         print(f"Requesting {url}")
+        host = ratecontrol.host_of(url)
         while retry:
+            # paced per host, failures slow the host down for retries
+            ratecontrol.CONTROLLER.reserve(host)
             try:
                 self.get_renderer().render(url)
                 campaign_page = self.get_renderer().result
                 if campaign_page is None:
                     raise Exception()
                 retry = False
+                ratecontrol.CONTROLLER.report(host, True)
             except:
+                ratecontrol.CONTROLLER.report(host, False)
                 if retry_count < RETRY_MAX:
                     retry = True
-                    print(f"sleep {SLEEP} secs before retrying request")
-                    time.sleep(SLEEP)
+                    print("retrying request")
                 else:
                     print(f"failed to request {retry_count} times")
                     retry = False
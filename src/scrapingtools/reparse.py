@@ -0,0 +1,170 @@
+import argparse
+import csv
+import datetime
+import itertools
+import os
+from multiprocessing import Pool
+
+from .utils import log_message as print
+from . import utils as utils
+from . import scrapers as scrapers
+from . import parsers as parsers
+from . import htmlcache as htmlcache
+from . import scrapemanager as scrapemanager
+
+OUTPATH = scrapemanager.OUTPATH / "reparsed"
+CHUNK_SIZE = 1000  # pages per task and per output file
+
+_cache = None  # the html cache of a worker process
+
+
+def output_filename_template(ii_num):
+    return f"reparsed_output_i{ii_num}.csv"
+
+
+def _init_worker(cache_path):
+    global _cache
+    _cache = htmlcache.HTMLCache(cache_path)
+
+
+def _status_message(page_status, quality, is_wayback):
+    # same messages as ScrapeManager._wayback_scrape and present_scrape_url
+    if is_wayback:
+        if page_status is scrapers.PageStatus.INACTIVE:
+            return "wayback: inactive"
+        elif page_status is scrapers.PageStatus.NOT_FOUND:
+            return "wayback: campaign not found"
+        elif quality >= scrapemanager.SCRAPE_QUALITY_THRESHOLD:
+            return "wayback: success"
+        return "wayback: scraped but did not meet success standard"
+    if page_status is scrapers.PageStatus.INACTIVE:
+        return "present: inactive"
+    elif page_status is scrapers.PageStatus.NOT_FOUND:
+        return "present: campaign not found"
+    elif quality >= scrapemanager.PRESENT_SCRAPE_QUALITY_THRESHOLD:
+        return "present: success"
+    return "present: scraped but did not meet success criteria"
+
+
+def reparse_entry(cache, entry, backend=parsers.PARSER_BACKEND):
+    """ scrapes one cached page into a row of the scrape output schema,
+    returns None if the page was evicted """
+    campaign_page = cache.load(entry, touch=False)
+    if campaign_page is None:
+        return None
+    is_wayback = entry["timestamp"] is not None
+    try:
+        page_status, row, quality = scrapemanager.scrape_campaign_page(
+            campaign_page,
+            scrapemanager.WAYBACK_SCRAPER_YEARS
+            if is_wayback
+            else scrapemanager.PRESENT_SCRAPER_YEARS,
+            backend=backend,
+        )
+        msg = _status_message(page_status, quality, is_wayback)
+    except Exception as e:
+        row = scrapers.empty_url_row(campaign_page.url, msg=str(e))
+        msg = ("wayback" if is_wayback else "present") + ": failed completely"
+    if is_wayback:
+        row["archive_timestamp"] = entry["timestamp"]
+    else:
+        row["archive_timestamp"] = datetime.datetime.fromtimestamp(
+            entry["stored_at"]
+        ).strftime("%Y%m%d%H%M%S")
+    row["query_url"] = entry["requested_url"]
+    row["gfm_url"] = entry["url"]
+    row["wayback_status"] = msg
+    return row
+
+
+def _reparse_chunk(task):
+    chunk_num, entries, outpath, backend = task
+    save_fullpath = outpath / output_filename_template(chunk_num * CHUNK_SIZE)
+    tmp_fpath = save_fullpath.with_name(save_fullpath.name + ".tmp")
+    n_rows = 0
+    with tmp_fpath.open(mode="w", encoding="utf-8", newline="") as outfile:
+        writer = csv.writer(outfile)
+        for entry in entries:
+            row = reparse_entry(_cache, entry, backend=backend)
+            if row is None:
+                continue
+            if n_rows == 0:
+                writer.writerow(row.keys())
+            writer.writerow(row.values())
+            n_rows += 1
+    if n_rows == 0:
+        tmp_fpath.unlink()
+        return None, 0
+    tmp_fpath.replace(save_fullpath)
+    return save_fullpath, n_rows
+
+
+def _chunk_entries(entries, chunk_size):
+    entries = iter(entries)
+    while True:
+        chunk = list(itertools.islice(entries, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def reparse(
+    cache_path=htmlcache.CACHE_PATH,
+    outpath=OUTPATH,
+    processes=None,
+    backend=parsers.PARSER_BACKEND,
+):
+    """ Re-scrapes every page in the html cache without touching the network.
+
+    Pages are split into chunks of CHUNK_SIZE and scraped on a pool of
+    processes, each chunk is written to its own reparsed_output_i{n}.csv
+    with the columns of the deploy output. There is one row per cached page
+    rather than per campaign, pick the best snapshot of a campaign downstream.
+    Outputs of earlier reparses in outpath are deleted first.
+    """
+    cache_path = utils.verify_pathtype(cache_path)
+    outpath = utils.verify_pathtype(outpath)
+    outpath.mkdir(parents=True, exist_ok=True)
+    # a rerun over a smaller cache writes fewer chunks, older ones would be
+    # read along with the new outputs
+    stale_fpaths = [
+        *outpath.glob(output_filename_template("*")),
+        *outpath.glob(output_filename_template("*") + ".tmp"),
+    ]
+    for stale_fpath in stale_fpaths:
+        stale_fpath.unlink()
+    if stale_fpaths:
+        print(f"[reparse] Deleted {len(stale_fpaths)} outputs of an earlier reparse")
+    processes = processes or os.cpu_count()
+    tasks = (
+        (chunk_num, chunk, outpath, backend)
+        for chunk_num, chunk in enumerate(
+            _chunk_entries(htmlcache.HTMLCache(cache_path).iter_entries(), CHUNK_SIZE)
+        )
+    )
+    print(f"[reparse] Reparsing {cache_path} with {processes} processes")
+    out_fpaths = []
+    n_total = 0
+    with Pool(processes, initializer=_init_worker, initargs=(cache_path,)) as pool:
+        for save_fullpath, n_rows in pool.imap_unordered(_reparse_chunk, tasks):
+            if save_fullpath is None:
+                continue
+            out_fpaths.append(save_fullpath)
+            n_total += n_rows
+            print(f"[reparse] Wrote {n_rows} rows to {save_fullpath.name}")
+    print(f"[reparse] Reparsed {n_total} pages into {len(out_fpaths)} files")
+    return sorted(out_fpaths)
+
+
+if __name__ == "__main__":
+    # python -m src.scrapingtools.reparse --processes 8 --backend lxml
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache_path", type=str, default=htmlcache.CACHE_PATH)
+    parser.add_argument("--outpath", type=str, default=OUTPATH)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument(
+        "--backend", choices=parsers.PARSER_BACKENDS, default=parsers.PARSER_BACKEND
+    )
+    args = parser.parse_args()
+
+    reparse(args.cache_path, args.outpath, args.processes, args.backend)
@@ -1,20 +1,30 @@
+import contextvars
+import csv
 import datetime
 import math
 import re
 from pathlib import Path
-import csv
 import warnings
 import urllib.parse as up
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
-from bs4 import BeautifulSoup
 
 from .utils import log_message as print
 from . import utils as utils
 from . import waybackinterface as wbi
 from . import scrapers as scrapers
+from . import parsers as parsers
 from . import seleniumcontainer as renderercontainer
+from . import httpcontainer as httpcontainer
+from . import cdxclient as cdxclient
+from . import cdxindex as cdxindex
+from . import htmlcache as htmlcache
+from . import checkpoint as checkpoint
+from . import sinks as sinks
+from . import urltable as urltable
+from . import metrics as metrics
 
 from .. import data_io
 
@@ -28,6 +38,36 @@ CAMPAIGNID_COLUMN = "cleaned_campaign_id"
 CAMPAIGNID_COLUMN2 = "campaign_id"
 SCRAPE_QUALITY_THRESHOLD = 17
 PRESENT_SCRAPE_QUALITY_THRESHOLD = 20
+# scrapers tried on each page; on quality ties the first year listed wins
+WAYBACK_SCRAPER_YEARS = ("2012", "2014", "2015", "2018", "2017", "2019")
+PRESENT_SCRAPER_YEARS = ("2018", "2019")
+# wayback captures are looked up for this many table rows at a time, with one
+# cdx prefix query per group of campaign ids sharing CDX_MIN_PREFIX_LENGTH
+# leading characters, instead of one query per url variant of every row
+CDX_PREFETCH_ROWS = 500
+CDX_PREFIX_GROUP_SIZE = 100
+CDX_MIN_PREFIX_LENGTH = 4
+# captures read per request of a prefix query, short prefixes match many more
+# campaigns than the group and are paged through with cdx resume keys
+CDX_PREFETCH_PAGE_SIZE = 5000
+
+
+def scrape_campaign_page(campaign_page, scraper_years, backend=parsers.PARSER_BACKEND):
+    """ runs the scrapers of every year on a page and keeps the best scrape,
+    returns (page status, row, quality) """
+    soup = parsers.parse_page(campaign_page.text, scraper_years, backend=backend)
+    result_dict = scrapers.scrape_url_eras(soup, campaign_page.url, scraper_years)
+    with metrics.span("page_status", campaign_page.url):
+        page_status = scrapers.page_status(campaign_page.text)
+    with metrics.span("quality", campaign_page.url):
+        result_quality = {k: wbi.scrape_quality(v) for k, v in result_dict.items()}
+    # first year with the highest quality
+    best_scraper_year = max(result_quality, key=result_quality.get)
+    return (
+        page_status,
+        result_dict[best_scraper_year],
+        result_quality[best_scraper_year],
+    )
 
 
 class ScrapeManager(object):
@@ -40,8 +80,25 @@ class ScrapeManager(object):
         campaignid_column2=CAMPAIGNID_COLUMN2,
         savepath=OUTPATH,
         use_wayback=True,
+        use_http_fast_path=True,
+        html_cache_path=htmlcache.CACHE_PATH,
+        cdx_index_path=None,
+        output_format="csv",
+        record_metrics=True,
     ):
+        if output_format not in sinks.SINKS:
+            raise ValueError(
+                f"unknown output format {output_format}, use one of {list(sinks.SINKS)}"
+            )
+        self.SINK = sinks.SINKS[output_format]
         self.savepath = savepath
+        # per stage timings of deploy, summarize with
+        # python -m src.scrapingtools.metrics
+        self.METRICS = (
+            metrics.SpanRecorder(self.savepath / metrics.METRICS_FILENAME)
+            if record_metrics
+            else None
+        )
         self.urltable_path = urltable_path
         self.URLTABLE_COLUMN = urltable_column
         self.URLTABLE_COLUMN2 = urltable_column2
@@ -53,6 +110,22 @@ class ScrapeManager(object):
         self.NEW_FILE_THRESH = 10000
         self.RENDER_CONTAINER = renderercontainer.RendererContainer()
         print("Initialized render container")
+        self.HTTP_CONTAINER = httpcontainer.HTTPContainer()
+        self.CDX_CLIENT = cdxclient.AsyncCDXClient()
+        # campaigns in the local index are only searched online for captures
+        # after its dump, in prefetches and url by url; build one with
+        # WaybackURLCollector().build_cdx_index()
+        self.CDX_INDEX = (
+            cdxindex.CDXIndex(cdx_index_path) if cdx_index_path else None
+        )
+        self.use_http_fast_path = use_http_fast_path
+        # fetched pages are kept here so reruns re-parse instead of re-fetching,
+        # pass html_cache_path=None to turn the cache off
+        self.HTML_CACHE = (
+            htmlcache.HTMLCache(html_cache_path) if html_cache_path else None
+        )
+        # "bs4" or "lxml", see parsers.py to check that both agree on your pages
+        self.PARSER_BACKEND = parsers.PARSER_BACKEND
         self.use_wayback = use_wayback
         self.MAX_NUMBER_OF_SNAPSHOTS = MAX_NUMBER_OF_SNAPSHOTS
 
@@ -131,12 +204,14 @@ class ScrapeManager(object):
             raise ValueError("{} does not exist, recheck path".format(urltable_path))
         elif not urltable_path.is_file():
             raise ValueError("{} is not a file".format(urltable_path))
-        self.URLTABLE = pd.read_csv(urltable_path, encoding="utf-8", dtype=str)
+        # converted once into an indexed sqlite table, rows are read in blocks
+        self.URLTABLE = urltable.URLTable(urltable_path)
+        self.start_index = self.URLTABLE.start
         self._urltable_path = urltable_path
 
     def output_filename_template(self, ii_num):
         # can change template but gotta leave ii_num in
-        return f"master_scraped_output_i{ii_num}.csv"
+        return f"master_scraped_output_i{ii_num}{self.SINK.extension}"
 
     def _most_recent_ifile_regex_pattern(self):
         return self.output_filename_template("(\d+)")
@@ -144,35 +219,57 @@ class ScrapeManager(object):
     def _most_recent_ifile_star_pattern(self):
         return self.output_filename_template("*")
 
+    def _scrape_campaign_page(self, campaign_page, scraper_years):
+        return scrape_campaign_page(
+            campaign_page, scraper_years, backend=self.PARSER_BACKEND
+        )
+
+    def _fetch_and_scrape(self, url, scraper_years, quality_threshold):
+        if self.HTML_CACHE is not None:
+            campaign_page = self.HTML_CACHE.get(url)
+            if campaign_page is not None:
+                print(f"Loaded {url} from html cache")
+                return self._scrape_campaign_page(campaign_page, scraper_years)
+        # browser renders are the most expensive step, so try a plain http
+        # request first and only render when its scrape falls short of the
+        # success threshold of the scraper
+        http_scraped = None
+        if self.use_http_fast_path:
+            campaign_page = self.HTTP_CONTAINER.fetch(url)
+            if campaign_page is not None:
+                scraped = self._scrape_campaign_page(campaign_page, scraper_years)
+                if scraped[2] >= quality_threshold:
+                    if self.HTML_CACHE is not None:
+                        self.HTML_CACHE.put(campaign_page)
+                    return scraped
+                print("http fast path below quality threshold, rendering in browser")
+                http_scraped = scraped
+        campaign_page = self.RENDER_CONTAINER.render(url)
+        if campaign_page is None:
+            # the short http scrape beats none, but isn't cached so that a
+            # rerun renders the page again
+            if http_scraped is not None:
+                print("browser render failed, keeping the http fast path scrape")
+            return http_scraped
+        scraped = self._scrape_campaign_page(campaign_page, scraper_years)
+        if self.HTML_CACHE is not None:
+            self.HTML_CACHE.put(campaign_page)
+        return scraped
+
     def _wayback_scrape(self, url_to_scrape):
         msg = "wayback: none"
-        #campaign_page = wbi.get_campaign_page(url_to_scrape)
-        campaign_page = self.RENDER_CONTAINER.render(url_to_scrape)
-        if campaign_page is None:
+        scraped = self._fetch_and_scrape(
+            url_to_scrape, WAYBACK_SCRAPER_YEARS, self.SCRAPE_QUALITY_THRESHOLD
+        )
+        if scraped is None:
             msg = "wayback: request failed"
             row = scrapers.empty_url_row(url_to_scrape)
             return row, msg
+        page_status, best_result, best_scraper_quality = scraped
 
-        soup = BeautifulSoup(campaign_page.text, features="lxml")
-
-        campaign_url = campaign_page.url
-
-        result_dict = {}
-        result_dict["2012"] = scrapers.scrape_url_2012(soup, campaign_url)
-        result_dict["2014"] = scrapers.scrape_url_2014(soup, campaign_url)
-        result_dict["2015"] = scrapers.scrape_url_2015(soup, campaign_url)
-        result_dict["2018"] = scrapers.scrape_url_2018(soup, campaign_url)
-        result_dict["2017"] = scrapers.scrape_url_2017(soup, campaign_url)
-        result_dict["2019"] = scrapers.scrape_url_2019(soup, campaign_url)
-
-        result_quality = {k: wbi.scrape_quality(v) for k, v in result_dict.items()}
-        best_scraper_year = pd.Series(result_quality).idxmax()
-        best_scraper_quality = result_quality[best_scraper_year]
-        best_result = result_dict[best_scraper_year]
-
-        if scrapers.is_inactive(soup):
+        if page_status is scrapers.PageStatus.INACTIVE:
             msg = "wayback: inactive"
-        elif scrapers.not_found(soup):
+        elif page_status is scrapers.PageStatus.NOT_FOUND:
             msg = "wayback: campaign not found"
         elif best_scraper_quality >= self.SCRAPE_QUALITY_THRESHOLD:
             msg = "wayback: success"
@@ -181,19 +278,81 @@ class ScrapeManager(object):
         print(msg)
         return best_result, msg
 
-    def wayback_search_and_scrape(self, urls_to_search):
+    def search_wayback_urls(self, urls_to_search):
+        """ search results of every url in the order of the input, None where
+        the search failed. Urls of campaigns in the cdx index are answered
+        from it and only searched online for the captures after it, the
+        others are searched online in full """
+        if self.CDX_INDEX is None:
+            return self.CDX_CLIENT.search_many(urls_to_search)
+        campaign_ids = wbi.extract_campaign_ids(pd.Series(urls_to_search, dtype=str))
+        indexed = []
+        for url_to_search, campaign_id in zip(urls_to_search, campaign_ids):
+            with metrics.span("wayback_search_index", url_to_search):
+                search_results = self.CDX_INDEX.lookup(campaign_id)
+            if search_results is not None:
+                print(
+                    f"Found {search_results.shape[0]} archives of"
+                    + f" {url_to_search} in index"
+                )
+            indexed.append(search_results)
+        in_index = [search_results is not None for search_results in indexed]
+        missing = iter(
+            self.CDX_CLIENT.search_many(
+                [url for url, hit in zip(urls_to_search, in_index) if not hit]
+            )
+            if not all(in_index)
+            else []
+        )
+        later = iter(
+            self.CDX_CLIENT.search_many(
+                [url for url, hit in zip(urls_to_search, in_index) if hit],
+                **self._captures_after_index(),
+            )
+            if any(in_index)
+            else []
+        )
+        all_search_results = []
+        for search_results in indexed:
+            if search_results is None:
+                all_search_results.append(next(missing))
+                continue
+            later_results = next(later)
+            if later_results is None:
+                print("search for captures after the index failed, using the index's")
+                all_search_results.append(search_results)
+                continue
+            all_search_results.append(
+                pd.concat(
+                    [search_results, later_results], ignore_index=True, sort=False
+                )
+                .drop_duplicates(subset=["timestamp", "original"])
+                .sort_values(by="timestamp")
+                .reset_index(drop=True)
+            )
+        return all_search_results
+
+    def wayback_search_and_scrape(self, urls_to_search, prefetched_results=None):
         try:
-            # Seach for snapshots on Wayback
+            # Seach for snapshots on Wayback, unless they were prefetched
             result_list = []
-            for url_to_search in urls_to_search:
-                search_results = wbi.search_wayback(url_to_search)
-                if search_results.empty:
+            if prefetched_results is None:
+                all_search_results = self.search_wayback_urls(urls_to_search)
+            else:
+                all_search_results = [prefetched_results]
+            for isearch, (url_to_search, search_results) in enumerate(
+                zip(urls_to_search, all_search_results)
+            ):
+                if search_results is None or search_results.empty:
                     continue
-                parent_urls = wbi.clean_wayback_search_results(search_results)
-                result_list.append(parent_urls)
+                result_list.append(search_results.assign(_search=isearch))
 
             if len(result_list) == 0:
-                msg = "wayback: url not found in archives"
+                # a failed search can't tell that the url was never archived
+                if any(sr is None for sr in all_search_results):
+                    msg = "wayback: search failed"
+                else:
+                    msg = "wayback: url not found in archives"
                 print(msg)
                 row = scrapers.empty_url_row(url_to_search)
                 row["archive_timestamp"] = "nat"
@@ -201,8 +360,13 @@ class ScrapeManager(object):
                 row["gfm_url"] = url_to_search
                 row["wayback_status"] = msg
             else:
-                search_results_all = pd.concat(
-                    result_list, ignore_index=True, sort=False
+                # every search is cleaned on its own, in one batch
+                search_results_all = wbi.clean_wayback_search_results(
+                    pd.concat(result_list, ignore_index=True, sort=False),
+                    by="_search",
+                ).drop(columns="_search")
+                search_results_all = wbi.plan_snapshot_probes(
+                    search_results_all, self.MAX_NUMBER_OF_SNAPSHOTS
                 )
                 if search_results_all.empty:
                     msg = "wayback: no archives found"
@@ -213,13 +377,12 @@ class ScrapeManager(object):
                     row["gfm_url"] = url_to_search
                     row["wayback_status"] = msg
                 else:
-                    search_results_all = search_results_all.sort_values(
-                        "timestamp", ascending=False
-                    )
-                    # iter thru most recent result first
+                    # probes start at the most recent snapshot and then
+                    # bisect the timeline, see wbi.plan_snapshot_probes
                     result_d = {}
-                    for niter, (iloc, sresult) in enumerate(
-                        search_results_all.iterrows()
+                    probe_d = {}
+                    for niter, sresult in enumerate(
+                        search_results_all.itertuples(index=False)
                     ):
                         gfm_url = sresult.original
                         timestamp_to_scrape = sresult.timestamp
@@ -230,14 +393,12 @@ class ScrapeManager(object):
                         )
                         row, msg = self._wayback_scrape(url_to_scrape)
                         result_d[niter] = (row, msg)
+                        probe_d[niter] = (timestamp_to_scrape, url_to_scrape, gfm_url)
                         if msg == "wayback: success":
                             break
-                        if niter > self.MAX_NUMBER_OF_SNAPSHOTS:
-                            break
-                        # ran through MAX_NUMBER_OF_SNAPSHOTS already and still no success
-                        # most likely due to the URL being an internal
-                        # gfm direct that is not a campaign page
-                    row, msg = self.process_wayback_scrape_result(result_d)
+                    niter = self._choose_wayback_scrape_result(result_d)
+                    row, msg = result_d[niter]
+                    timestamp_to_scrape, url_to_scrape, gfm_url = probe_d[niter]
                     print(msg)
                     row["archive_timestamp"] = timestamp_to_scrape
                     row["query_url"] = url_to_scrape
@@ -252,28 +413,21 @@ class ScrapeManager(object):
             row["wayback_status"] = "wayback: failed completely"
         return row
 
+    def _choose_wayback_scrape_result(self, result_d):
+        # first success, else first inactive, else first low quality scrape,
+        # else the first probe
+        for wanted_msg in (
+            "wayback: success",
+            "wayback: inactive",
+            "wayback: scraped but did not meet success standard",
+        ):
+            for niter, (row, msg) in result_d.items():
+                if msg == wanted_msg:
+                    return niter
+        return next(iter(result_d))
+
     def process_wayback_scrape_result(self, result_d):
-        result_df = pd.DataFrame.from_dict(
-            result_d, columns=["row", "msg"], orient="index"
-        )
-        if (result_df.msg == "wayback: success").any():
-            # choose first most waybacksuccess
-            out_res = result_df[result_df.msg == "wayback: success"].iloc[0, :]
-            row, msg = out_res.row, out_res.msg
-        elif (result_df.msg == "wayback: inactive").any():
-            out_res = result_df[result_df.msg == "wayback: inactive"].iloc[0, :]
-            row, msg = out_res.row, out_res.msg
-        elif (
-            result_df.msg == "wayback: scraped but did not meet success standard"
-        ).any():
-            out_res = result_df[
-                result_df.msg == "wayback: scraped but did not meet success standard"
-            ].iloc[0, :]
-            row, msg = out_res.row, out_res.msg
-        else:
-            out_res = result_df.iloc[0, :]
-            row, msg = out_res.row, out_res.msg
-        return row, msg
+        return result_d[self._choose_wayback_scrape_result(result_d)]
 
     def present_scrape_url(self, urls_to_search):
         current_dt = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
@@ -282,28 +436,22 @@ class ScrapeManager(object):
         for url_to_search in urls_to_search:
             err_msg = "present: none"
             print(f"Present scraping: {url_to_search}")
-            # campaign_page = wbi.get_campaign_page_accept_non_working(url_to_search).text
-            campaign_page = self.RENDER_CONTAINER.render(url_to_search)
-            if campaign_page is None:
+            scraped = self._fetch_and_scrape(
+                url_to_search,
+                PRESENT_SCRAPER_YEARS,
+                self.PRESENT_SCRAPE_QUALITY_THRESHOLD,
+            )
+            if scraped is None:
                 err_msg = "present: request failed"
                 print(err_msg)
                 row = scrapers.empty_url_row(url_to_search, msg=err_msg)
                 continue
-            soup = BeautifulSoup(campaign_page.text, features="lxml")
-
-            campaign_url = campaign_page.url
-            result_dict = {}
-            result_dict["2018"] = scrapers.scrape_url_2018(soup, campaign_url)
-            result_dict["2019"] = scrapers.scrape_url_2019(soup, campaign_url)
-            result_quality = {k: wbi.scrape_quality(v) for k, v in result_dict.items()}
-            best_scraper_year = pd.Series(result_quality).idxmax()
-            best_scraper_quality = result_quality[best_scraper_year]
-            row = result_dict[best_scraper_year]
-
-            if scrapers.is_inactive(soup):
+            page_status, row, best_scraper_quality = scraped
+
+            if page_status is scrapers.PageStatus.INACTIVE:
                 err_msg = "present: inactive"
                 print(err_msg)
-            elif scrapers.not_found(soup):
+            elif page_status is scrapers.PageStatus.NOT_FOUND:
                 err_msg = "present: campaign not found"
                 print(err_msg)
             elif best_scraper_quality >= self.PRESENT_SCRAPE_QUALITY_THRESHOLD:
@@ -324,23 +472,10 @@ class ScrapeManager(object):
 
         return row, scrape_sucess
 
-    def _create_new_outfile(self, save_fullpath):
-        print(f"creating new outfile {save_fullpath}")
-        outfile = save_fullpath.open(mode="w", encoding="utf-8", newline="")
-        writer = csv.writer(outfile)
-        return writer, outfile
-
     def _make_save_fullpath(self, index):
         ii_num = (index // self.NEW_FILE_THRESH) * self.NEW_FILE_THRESH
         return self.savepath / self.output_filename_template(ii_num)
 
-    def _load_outfile(self, save_fullpath):
-        # loads an existing filepath
-        print(f"loading outfile {save_fullpath}")
-        outfile = save_fullpath.open(mode="a", encoding="utf-8", newline="")
-        writer = csv.writer(outfile)
-        return writer, outfile
-
     def _get_save_fullpath(self, index):
         # returns an existing filepath
         ii_num = int(math.floor(index / self.NEW_FILE_THRESH) * self.NEW_FILE_THRESH)
@@ -356,7 +491,12 @@ class ScrapeManager(object):
                 ]
             ),
         )[-1]
-        ifile_df = pd.read_csv(ifilepath, encoding="utf-8")
+        if self.SINK is sinks.ParquetSink:
+            ifile_df = sinks.read_parquet_outfile(ifilepath, columns=["gfm_url"])
+        else:
+            ifile_df = pd.read_csv(ifilepath, encoding="utf-8")
+        if ifile_df.empty:
+            raise ValueError(f"{ifilepath} has no scraped rows to resume after")
         last_url = ifile_df.iloc[-1, :].gfm_url
         return last_url
 
@@ -367,24 +507,20 @@ class ScrapeManager(object):
         ).lower()
         url_index_d = OrderedDict()
         if self.CAMPAIGNID_COLUMN:
-            last_scraped_url_index = self.URLTABLE.index[
-                self.URLTABLE[self.CAMPAIGNID_COLUMN].str.lower() == last_campaign_id
-            ].values
-            url_index_d["CAMPAIGNID_COLUMN"] = last_scraped_url_index
+            url_index_d["CAMPAIGNID_COLUMN"] = self.URLTABLE.find_indices(
+                self.CAMPAIGNID_COLUMN, last_campaign_id
+            )
         if self.CAMPAIGNID_COLUMN2:
-            last_scraped_url_index = self.URLTABLE.index[
-                self.URLTABLE[self.CAMPAIGNID_COLUMN2].str.lower() == last_campaign_id
-            ].values
-            url_index_d["CAMPAIGNID_COLUMN2"] = last_scraped_url_index
+            url_index_d["CAMPAIGNID_COLUMN2"] = self.URLTABLE.find_indices(
+                self.CAMPAIGNID_COLUMN2, last_campaign_id
+            )
         if self.URLTABLE_COLUMN2:
-            last_scraped_url_index = self.URLTABLE.index[
-                self.URLTABLE[self.URLTABLE_COLUMN2].str.lower() == last_scraped_url
-            ].values
-            url_index_d["URLTABLE_COLUMN2"] = last_scraped_url_index
-        last_scraped_url_index = self.URLTABLE.index[
-            self.URLTABLE[self.URLTABLE_COLUMN].str.lower() == last_scraped_url
-        ].values
-        url_index_d["URLTABLE_COLUMN"] = last_scraped_url_index
+            url_index_d["URLTABLE_COLUMN2"] = self.URLTABLE.find_indices(
+                self.URLTABLE_COLUMN2, last_scraped_url
+            )
+        url_index_d["URLTABLE_COLUMN"] = self.URLTABLE.find_indices(
+            self.URLTABLE_COLUMN, last_scraped_url
+        )
         last_scraped_url_indices = [v[0] for k, v in url_index_d.items() if len(v) > 0]
         if len(last_scraped_url_indices) == 0:
             raise ValueError(
@@ -397,20 +533,20 @@ class ScrapeManager(object):
         print(f"Last scraped url was {last_scraped_url}")
         print(f"Last scraped index was {last_scraped_url_index}")
         print(f"Resuming scrape from index {resume_index}")
-        self.URLTABLE = self.URLTABLE.loc[resume_index:, :]
+        self.start_index = resume_index
 
     def start_from_specific_index(self, resume_index):
         print(f"Starting scrape from index {resume_index}")
-        self.URLTABLE = self.URLTABLE.loc[resume_index:, :]
+        self.start_index = resume_index
 
     def start_from_specific_campaign_id(self, campaign_id):
-        resume_index = self.URLTABLE.index[
-            self.URLTABLE["cleaned_campaign_id"] == campaign_id
-        ].values[0]
-        resume_url = self.URLTABLE.loc[resume_index, "cleaned_url"]
+        resume_index = self.URLTABLE.find_indices(
+            "cleaned_campaign_id", campaign_id, case_sensitive=True
+        )[0]
+        resume_url = self.URLTABLE.get_row(resume_index)["cleaned_url"]
         print(f"URL to start scraping is {resume_url}")
         print(f"Starting scrape from index {resume_index}")
-        self.URLTABLE = self.URLTABLE.loc[resume_index:, :]
+        self.start_index = resume_index
 
     def create_gfm_urls_for_search_from_tablerow(self, w_url):
         urls_to_search = [w_url[self.URLTABLE_COLUMN]]
@@ -444,61 +580,304 @@ class ScrapeManager(object):
             base_url += "#" + parsed.fragment
         return base_url
 
-    def deploy(self, resume=False, start_index=None, start_campaign=None):
+    def _tablerow_campaign_ids(self, w_url):
+        campaign_ids = []
+        for col in (self.CAMPAIGNID_COLUMN, self.CAMPAIGNID_COLUMN2):
+            if col and not pd.isna(w_url[col]) and w_url[col].strip() != "":
+                campaign_ids.append(w_url[col].strip().lower())
+        return campaign_ids
+
+    def _captures_after_index(self):
+        # cdx query parameters of the captures the index was built without
+        return {"from": str(self.CDX_INDEX.last_timestamp)}
+
+    def _prefetch_prefix_queries(self, campaign_ids, **params):
+        """ (search results, ids of the groups whose query failed) of the
+        prefix queries covering campaign_ids """
+        groups = wbi.group_campaign_ids_by_prefix(
+            campaign_ids, CDX_PREFIX_GROUP_SIZE, CDX_MIN_PREFIX_LENGTH
+        )
+        # cdx ignores the scheme and www, so these two cover all url variants
+        queries = [
+            (prefix, template + prefix)
+            for prefix in groups
+            for template in ("gofundme.com/", "gofundme.com/f/")
+        ]
+        print(
+            f"Prefetching wayback captures of {len(set(campaign_ids))} campaigns "
+            f"with {len(queries)} queries"
+        )
+        with metrics.span("wayback_prefetch"):
+            all_search_results = self.CDX_CLIENT.search_many(
+                [url_to_search for _, url_to_search in queries],
+                page_size=CDX_PREFETCH_PAGE_SIZE,
+                filter="statuscode:200",
+                collapse="digest",
+                **params,
+            )
+        failed_ids = set()
+        found = []
+        for (prefix, _), search_results in zip(queries, all_search_results):
+            if search_results is None:
+                failed_ids.update(groups[prefix])
+            elif not search_results.empty:
+                found.append(search_results)
+        if len(found) == 0:
+            return pd.DataFrame(columns=wbi.SEARCH_RESULT_HEADER), failed_ids
+        search_results = pd.concat(found, ignore_index=True, sort=False)
+        return search_results.drop_duplicates(), failed_ids
+
+    def prefetch_wayback_search_results(self, block):
+        """ looks up the wayback captures of every campaign id in a block of
+        the url table with a few prefix queries, returns {campaign id: search
+        results} with the ids lowercased. Campaigns in the cdx index are only
+        queried for the captures after it. """
+        if not (self.CAMPAIGNID_COLUMN or self.CAMPAIGNID_COLUMN2):
+            return {}
+        campaign_ids = [
+            campaign_id
+            for _, w_url in block.iterrows()
+            for campaign_id in self._tablerow_campaign_ids(w_url)
+        ]
+        if len(campaign_ids) == 0:
+            return {}
+        indexed = {}
+        if self.CDX_INDEX is not None:
+            indexed = self.CDX_INDEX.lookup_many(campaign_ids)
+        searches = [
+            ([c for c in campaign_ids if c not in indexed], {}),
+            (list(indexed), self._captures_after_index() if indexed else {}),
+        ]
+        # ids of a group whose query failed are left out of the index, so
+        # their rows fall back to searching url by url
+        failed_ids = set()
+        prefetched = {}
+        for search_ids, params in searches:
+            if len(search_ids) == 0:
+                continue
+            search_results, search_failed_ids = self._prefetch_prefix_queries(
+                search_ids, **params
+            )
+            failed_ids.update(search_failed_ids)
+            prefetched.update(
+                wbi.index_search_results_by_campaign_id(
+                    search_results,
+                    [c for c in search_ids if c not in search_failed_ids],
+                )
+            )
+        if failed_ids:
+            print(
+                f"Prefetch failed for {len(failed_ids)} campaigns,"
+                + " searching them url by url"
+            )
+        for campaign_id, search_results in indexed.items():
+            if campaign_id in prefetched:
+                prefetched[campaign_id] = (
+                    pd.concat(
+                        [search_results, prefetched[campaign_id]],
+                        ignore_index=True,
+                        sort=False,
+                    )
+                    .drop_duplicates(subset=["timestamp", "original"])
+                    .sort_values(by="timestamp")
+                    .reset_index(drop=True)
+                )
+        return prefetched
+
+    def _prefetched_results_for_tablerow(self, w_url, wayback_search_results):
+        if not wayback_search_results:
+            return None
+        campaign_ids = self._tablerow_campaign_ids(w_url)
+        if len(campaign_ids) == 0 or any(
+            campaign_id not in wayback_search_results for campaign_id in campaign_ids
+        ):
+            return None
+        return pd.concat(
+            [wayback_search_results[campaign_id] for campaign_id in campaign_ids],
+            ignore_index=True,
+            sort=False,
+        ).drop_duplicates()
+
+    def scrape_tablerow(self, w_url, wayback_search_results=None):
+        urls_to_search = self.create_gfm_urls_for_search_from_tablerow(w_url)
+        print(f"Processing: {urls_to_search}")
+        row_p, present_scrape_sucess = self.present_scrape_url(urls_to_search)
+        if present_scrape_sucess or (not self.use_wayback):
+            return row_p
+        # search with domain and prefix on wayback then scrape
+        urls_to_search2 = [
+            self.construct_simple_gfm_url_for_wayback_query(_url)
+            for _url in urls_to_search
+        ]
+        urls_to_search2 = pd.unique(urls_to_search2)
+        row_w = self.wayback_search_and_scrape(
+            urls_to_search2,
+            self._prefetched_results_for_tablerow(w_url, wayback_search_results),
+        )
+        if (
+            (row_w["wayback_status"] == "wayback: success")
+            | (
+                row_w["wayback_status"]
+                == "wayback: scraped but did not meet success standard"
+            )
+            | (row_w["wayback_status"] == "wayback: inactive")
+        ):
+            row = row_w
+            row["wayback_status"] = (
+                row_p["wayback_status"] + " ; " + row["wayback_status"]
+            )
+        else:
+            row = row_p
+            row["wayback_status"] = (
+                row["wayback_status"] + " ; " + row_w["wayback_status"]
+            )
+        return row
+
+    def _split_urltable_into_blocks(self):
+        # one (start, stop) index range per master_scraped_output_i{n} file, so
+        # that every output file is only ever written by a single worker; the
+        # rows of a block are only read when it is deployed
+        first_ii_num = (self.start_index // self.NEW_FILE_THRESH) * self.NEW_FILE_THRESH
+        return [
+            (max(ii_num, self.start_index), ii_num + self.NEW_FILE_THRESH)
+            for ii_num in range(first_ii_num, self.URLTABLE.stop, self.NEW_FILE_THRESH)
+        ]
+
+    def _count_scraped_rows(self, save_fullpath):
+        if not save_fullpath.exists() or save_fullpath.stat().st_size == 0:
+            return 0
+        # records, not lines: scraped stories hold quoted newlines; nothing
+        # is converted or kept, so this streams through the file
+        with save_fullpath.open(encoding="utf-8", newline="") as outfile:
+            n_records = sum(1 for _ in csv.reader(outfile))
+        return max(n_records - 1, 0)  # the header
+
+    def _journal(self, save_fullpath):
+        return checkpoint.CheckpointJournal(save_fullpath.with_suffix(".journal"))
+
+    def _has_journals(self):
+        journal_star_pattern = self._most_recent_ifile_star_pattern().replace(
+            self.SINK.extension, ".journal"
+        )
+        return any(self.savepath.glob(journal_star_pattern))
+
+    def _resume_block(self, block):
+        first_index = block.index[0]
+        save_fullpath = self._get_save_fullpath(first_index)
+        journal = self._journal(save_fullpath)
+        if journal.exists() and save_fullpath.exists():
+            # drop whatever was written after the last checkpoint
+            last_index = self.SINK.rollback(save_fullpath, journal)
+            if last_index is None:
+                return block
+            print(f"Resuming block {first_index} after index {last_index}")
+            return block[block.index > last_index]
+        # outputs from before journals: rows of a block are written in table
+        # order, so the number of rows already in its outfile tells us where
+        # the block left off
+        if (first_index % self.NEW_FILE_THRESH) != 0 or self.SINK is not sinks.CSVSink:
+            return block
+        n_scraped = self._count_scraped_rows(self._get_save_fullpath(first_index))
+        if n_scraped > 0:
+            print(f"Resuming block {first_index} after {n_scraped} scraped rows")
+        return block.iloc[n_scraped:, :]
+
+    def _iter_prefetched_rows(self, block):
+        for start in range(0, block.shape[0], CDX_PREFETCH_ROWS):
+            sub_block = block.iloc[start : start + CDX_PREFETCH_ROWS, :]
+            wayback_search_results = (
+                self.prefetch_wayback_search_results(sub_block)
+                if self.use_wayback
+                else None
+            )
+            for index, w_url in sub_block.iterrows():
+                yield index, w_url, wayback_search_results
+
+    def _deploy_block(self, block):
+        sink, journal, written_index = None, None, None
+        try:
+            for index, w_url, wayback_search_results in self._iter_prefetched_rows(
+                block
+            ):
+                url = w_url[self.URLTABLE_COLUMN]
+                with metrics.span("row", url):
+                    row = self.scrape_tablerow(w_url, wayback_search_results)
+                if sink is None:
+                    new = (index % self.NEW_FILE_THRESH) == 0
+                    if new:
+                        save_fullpath = self._make_save_fullpath(index)
+                    # if starting mid-block
+                    else:
+                        save_fullpath = self._get_save_fullpath(index)
+                    sink = self.SINK(save_fullpath, new)
+                    journal = self._journal(save_fullpath)
+                    journal.open(new=new)
+                with metrics.span("write", url):
+                    sink.write(row)
+                    written_index = index
+                    # rows are on disk before their index is journaled, a crash
+                    # only costs rescraping the rows since the last checkpoint
+                    sink.commit(journal, index)
+        finally:
+            if sink is not None:
+                sink.close(journal, written_index)
+            if journal is not None:
+                journal.close()
+
+    def _deploy_block_range(self, start, stop, resume):
+        block = self.URLTABLE.read_range(start, stop)
+        if resume and not block.empty:
+            block = self._resume_block(block)
+        if block.empty:
+            return
+        self._deploy_block(block)
+
+    def deploy(self, resume=False, start_index=None, start_campaign=None, workers=1):
+        # spans of this manager only, other managers record to their own file
+        with metrics.recording(self.METRICS):
+            self._deploy(resume, start_index, start_campaign, workers)
+
+    def _deploy(self, resume, start_index, start_campaign, workers):
+        # a resume picks up where the outputs left off, whatever the start
+        journaled_resume = resume and self._has_journals()
         if resume:
-            self.start_from_latest_ifile()
+            if start_index or start_campaign:
+                print("Resuming, ignoring start_index and start_campaign")
+            # journals mark where every block left off, otherwise the outputs
+            # were written before journals existed: one worker resumes after
+            # the last scraped url, several after the rows of every outfile
+            if not journaled_resume and workers <= 1:
+                self.start_from_latest_ifile()
         elif start_index:
             self.start_from_specific_index(start_index)
         elif start_campaign:
             self.start_from_specific_campaign_id(start_campaign)
 
-        i = 0
-        for index, w_url in self.URLTABLE.iterrows():
-            urls_to_search = self.create_gfm_urls_for_search_from_tablerow(w_url)
-            print(f"Processing: {urls_to_search}")
-            row_p, present_scrape_sucess = self.present_scrape_url(urls_to_search)
-            if present_scrape_sucess or (not self.use_wayback):
-                row = row_p
-            else:
-                # search with domain and prefix on wayback then scrape
-                urls_to_search2 = [
-                    self.construct_simple_gfm_url_for_wayback_query(_url)
-                    for _url in urls_to_search
-                ]
-                urls_to_search2 = pd.unique(urls_to_search2)
-                row_w = self.wayback_search_and_scrape(urls_to_search2)
-                if (
-                    (row_w["wayback_status"] == "wayback: success")
-                    | (
-                        row_w["wayback_status"]
-                        == "wayback: scraped but did not meet success standard"
-                    )
-                    | (row_w["wayback_status"] == "wayback: inactive")
-                ):
-                    row = row_w
-                    row["wayback_status"] = (
-                        row_p["wayback_status"] + " ; " + row["wayback_status"]
-                    )
-                else:
-                    row = row_p
-                    row["wayback_status"] = (
-                        row["wayback_status"] + " ; " + row_w["wayback_status"]
+        if workers > 1:
+            blocks = self._split_urltable_into_blocks()
+            # every worker holds at most one browser session at a time
+            self.RENDER_CONTAINER.pool_size = max(
+                self.RENDER_CONTAINER.pool_size, workers
+            )
+            print(f"Scraping {len(blocks)} blocks with {workers} workers")
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # workers record their spans to this manager's metrics too
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run,
+                        self._deploy_block_range,
+                        start,
+                        stop,
+                        resume,
                     )
+                    for start, stop in blocks
+                ]
+                for future in futures:
+                    future.result()
+            return
 
-            if (index % self.NEW_FILE_THRESH) == 0:
-                if i > 0:
-                    outfile.close()  # close old file
-                writer, outfile = self._create_new_outfile(
-                    self._make_save_fullpath(index)
-                )
-                writer.writerow(row.keys())
-            # if first loop but starting mid-dataframe
-            elif i == 0:
-                writer, outfile = self._load_outfile(self._get_save_fullpath(index))
-
-            writer.writerow(row.values())
-            i += 1
-        outfile.close()
+        for start, stop in self._split_urltable_into_blocks():
+            self._deploy_block_range(start, stop, journaled_resume)
 
 
 # Usage
@@ -508,3 +887,9 @@ class ScrapeManager(object):
 # ScrapeManager().deploy(resume=True)
 # ScrapeManager().deploy(start_index=5)
 # ScrapeManager().deploy(start_campaign='Supporting-local-artistic-ventures-')
+# ScrapeManager().deploy(workers=4)
+# ScrapeManager().deploy(resume=True, workers=4)
+# ScrapeManager(cdx_index_path=data_io.input_raw / "wayback_20200219" / "cdx_index")
+#     .deploy()
+# ScrapeManager(output_format="parquet").deploy()
+# sinks.read_parquet_output(OUTPATH, columns=["url", "title", "raised_amnt"])
@@ -1,7 +1,10 @@
+import enum
 import unicodedata
 import re
 import json
 
+from . import metrics as metrics
+
 empty_row = {
     "url": "none",
     "last_donation_time": "none",
@@ -35,45 +38,272 @@ def empty_url_row(url, msg="none"):
     return erow
 
 
+INACTIVE_MARKERS = (
+    "Campaign is complete and no longer active",
+    "fundraiser is no longer accepting donations",
+    "currently disabled new donations",
+)
+NOT_FOUND_MARKERS = ("Campaign Not Found",)
+INACTIVE_PATTERN = re.compile(
+    "|".join(re.escape(m) for m in INACTIVE_MARKERS), re.IGNORECASE
+)
+NOT_FOUND_PATTERN = re.compile(
+    "|".join(re.escape(m) for m in NOT_FOUND_MARKERS), re.IGNORECASE
+)
+# markup the page status scan steps over whole: script and style contents
+# (bundles and i18n strings hold every marker phrase), comments, and tags with
+# their attributes; only the markers in the page's text nodes count
+NON_TEXT_MARKUP = (
+    r"<script\b.*?</script\s*>|<style\b.*?</style\s*>|<!--.*?-->|<[^>]*>"
+)
+PAGE_STATUS_PATTERN = re.compile(
+    "{}|(?P<inactive>{})|(?P<not_found>{})".format(
+        NON_TEXT_MARKUP, INACTIVE_PATTERN.pattern, NOT_FOUND_PATTERN.pattern
+    ),
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+class PageStatus(enum.Enum):
+    ACTIVE = "active"
+    INACTIVE = "inactive"
+    NOT_FOUND = "not found"
+
+
+def page_status(html):
+    """ classifies a page from one scan of its raw html, by the markers in
+    its text outside scripts, styles, comments and attributes. An inactive
+    marker anywhere on the page wins over a not found marker """
+    status = PageStatus.ACTIVE
+    for match in PAGE_STATUS_PATTERN.finditer(html):
+        if match.lastgroup == "inactive":
+            return PageStatus.INACTIVE
+        if match.lastgroup == "not_found":
+            status = PageStatus.NOT_FOUND
+    return status
+
+
 def is_inactive(soup):
-    logic_1 = (
-        len(
-            soup.find_all(
-                string=re.compile(
-                    "Campaign is complete and no longer active", re.IGNORECASE
-                )
-            )
-        )
-        > 0
-    )
-    logic_2 = (
-        len(
-            soup.find_all(
-                string=re.compile(
-                    "fundraiser is no longer accepting donations", re.IGNORECASE
-                )
-            )
-        )
-        > 0
-    )
-    logic_3 = (
-        len(
-            soup.find_all(
-                string=re.compile("currently disabled new donations", re.IGNORECASE)
-            )
-        )
-        > 0
-    )
-    return logic_1 | logic_2 | logic_3
+    return len(soup.find_all(string=INACTIVE_PATTERN)) > 0
 
 
 def not_found(soup):
-    return (
-        len(soup.find_all(string=re.compile("Campaign Not Found", re.IGNORECASE))) > 0
-    )
+    return len(soup.find_all(string=NOT_FOUND_PATTERN)) > 0
+
+WINDOW_INITIAL_STATE_PATTERN = re.compile(r'window\.initialState = ')
+
+# Top-level lookups each era's scraper makes as (tag name, attribute, value).
+# PageIndex answers all of them from one walk over the page; lookups missing
+# from this table still work but fall back to a full BeautifulSoup search.
+STRING = None  # stands for the string= argument instead of an attribute
+ERA_SELECTORS = {
+    "2012": [
+        ("script", STRING, WINDOW_INITIAL_STATE_PATTERN),
+        ("p", "class", re.compile(r"fby")),
+        ("div", "class", "cmts_top geo it"),
+        ("p", "class", "rd lts"),
+        ("a", "class", "place"),
+        ("p", "class", "abt_by"),
+        ("div", "class", re.compile("abt_text")),
+        ("meta", "name", "description"),
+        ("div", "class", "mtr1"),
+        ("a", "class", "category"),
+        ("p", "class", "ml_16 damt mt_10 txt1"),
+        ("p", "class", "ml_16 dtime it"),
+        ("p", "class", "ud_by"),
+        ("div", "class", "charity-details"),
+    ],
+    "2013": [
+        ("script", STRING, WINDOW_INITIAL_STATE_PATTERN),
+        ("p", "class", re.compile(r"fby")),
+        ("div", "class", re.compile(r"social-share")),
+        ("p", "class", re.compile(r"rd_sub.*lts")),
+        ("a", "class", re.compile(r"place")),
+        ("p", "class", re.compile(r"abt_by")),
+        ("div", "class", re.compile(r"abt.*(mid|post|text)")),
+        ("meta", "name", "description"),
+        ("div", "class", "mtr1"),
+        ("a", "class", "category"),
+        ("p", "class", "ml_16 damt mt_10 txt1"),
+        ("p", "class", "ml_16 dtime it"),
+        ("p", "class", "ud_by"),
+        ("div", "class", "charity-details"),
+    ],
+    "2014": [
+        ("script", STRING, WINDOW_INITIAL_STATE_PATTERN),
+        ("p", "class", "fb fby"),
+        ("div", "class", "cmts_top geo it"),
+        ("p", "class", "rd_sub lts"),
+        ("a", "class", "place"),
+        ("p", "class", "abt_by"),
+        ("span", "class", re.compile(r"m-campaign-byline-created")),
+        ("div", "class", re.compile("abt_mid")),
+        ("meta", "name", "description"),
+        ("div", "class", "mtr1"),
+        ("a", "class", "category"),
+        ("p", "class", "ml_16 damt mt_10 txt1"),
+        ("p", "class", "ml_16 dtime it"),
+        ("p", "class", "ud_by"),
+        ("div", "class", "charity-details"),
+    ],
+    "2015": [
+        ("script", STRING, WINDOW_INITIAL_STATE_PATTERN),
+        ("div", "class", re.compile("fave-num")),
+        ("div", "class", re.compile("raised")),
+        ("a", "class", re.compile("loc ")),
+        ("div", "class", re.compile("pg_msg")),
+        ("div", "class", re.compile("time")),
+        ("div", "class", re.compile("cbdate")),
+        ("div", "id", re.compile("top-share-bar")),
+        ("meta", "name", "description"),
+        ("a", "class", "cat"),
+        ("div", "class", re.compile("damt")),
+        ("div", "class", re.compile("dtime")),
+        ("div", "id", "allUpdates"),
+        ("div", "class", "charity-details"),
+    ],
+    "2017": [
+        ("script", STRING, WINDOW_INITIAL_STATE_PATTERN),
+        ("div", "class", re.compile(r"heart fave-num")),
+        ("strong", "class", re.compile(r"share-count")),
+        ("h2", "class", re.compile(r"goal")),
+        ("a", "class", re.compile(r"location-name")),
+        ("div", "id", re.compile(r"story.*description")),
+        ("div", "class", re.compile(r"campaign-status")),
+        ("div", "class", re.compile("created-date")),
+        ("meta", "name", re.compile(r"description")),
+        ("a", "class", re.compile(r"category.*link")),
+        ("div", "class", re.compile(r"supporter-amount")),
+        ("div", "class", re.compile(r"supporter-time")),
+        ("div", "class", re.compile(r"charity-details")),
+    ],
+    "2018": [
+        ("script", STRING, WINDOW_INITIAL_STATE_PATTERN),
+        ("div", "class", re.compile(r"heart fave-num")),
+        ("strong", "class", re.compile(r"share-count")),
+        ("div", "class", re.compile(r"campaign-status")),
+        ("a", "class", re.compile(r"location")),
+        ("div", "class", re.compile(r"created-date")),
+        ("div", "class", re.compile(r"story.*description")),
+        ("meta", "name", "description"),
+        ("h2", "class", re.compile(r"goal")),
+        ("a", "class", re.compile(r"category.*link")),
+        ("div", "class", re.compile(r"supporter-amount")),
+        ("div", "class", re.compile(r"supporter-time")),
+        ("div", "class", re.compile(r"charity-details")),
+    ],
+    "2019": [
+        ("script", STRING, WINDOW_INITIAL_STATE_PATTERN),
+        ("div", "class", re.compile(r"social-stats")),
+        ("div", "class", re.compile(r"m-social-stats")),
+        ("span", "class", re.compile(r"campaign-byline-created")),
+        ("span", "class", re.compile(r"m-campaign-byline-created")),
+        ("span", "class", re.compile(r"created-date")),
+        ("div", "class", re.compile("campaign-story")),
+        ("meta", "name", "description"),
+        ("header", "class", "m-update-info"),
+        ("a", "class", re.compile(r"campaign-byline-type")),
+        ("li", "class", re.compile(r"donation-list-item")),
+    ],
+}
+
+
+def _selector_key(name, attr, value):
+    if hasattr(value, "search"):
+        return (name, attr, "re", value.pattern, value.flags)
+    return (name, attr, "eq", value)
+
+
+def _attr_matches(attr_value, match_against):
+    # same rules as BeautifulSoup: multi-valued attributes such as class match
+    # if any single value matches or if the space-joined values match
+    if attr_value is None:
+        return False
+    if isinstance(attr_value, (list, tuple)):
+        for item in attr_value:
+            if _attr_matches(item, match_against):
+                return True
+        return _attr_matches(" ".join(attr_value), match_against)
+    if hasattr(match_against, "search"):
+        return match_against.search(attr_value) is not None
+    return attr_value == match_against
+
+
+class PageIndex(object):
+    """ Stands in for a BeautifulSoup page in the scrape_url_* functions.
+
+    The tree is walked once on construction and every selector in the table
+    is matched during that walk, so the top-level find_all/find/title lookups
+    of all eras are answered without walking the tree again. The parsed
+    window.initialState script is likewise shared by all eras.
+    """
+
+    def __init__(self, soup, selectors):
+        self.soup = soup
+        self.title = None
+        self._matches = {}
+        selectors_by_name = {}
+        for name, attr, value in selectors:
+            key = _selector_key(name, attr, value)
+            if key not in self._matches:
+                self._matches[key] = []
+                selectors_by_name.setdefault(name, []).append((attr, value, key))
+        for tag in self._iter_tags():
+            if tag.name == "title" and self.title is None:
+                self.title = tag
+            for attr, value, key in selectors_by_name.get(tag.name, ()):
+                if attr is STRING:
+                    if _attr_matches(tag.string, value):
+                        self._matches[key].append(tag)
+                elif _attr_matches(tag.get(attr), value):
+                    self._matches[key].append(tag)
+        self._campaign_state = None
+        self._campaign_state_error = None
+
+    def _iter_tags(self):
+        return self.soup.find_all(True)
+
+    def _lookup_key(self, name, attrs, kwargs):
+        if attrs and not kwargs and len(attrs) == 1:
+            (attr, value), = attrs.items()
+            return _selector_key(name, attr, value)
+        if not attrs and list(kwargs) == ["string"]:
+            return _selector_key(name, STRING, kwargs["string"])
+        return None
+
+    def find_all(self, name=None, attrs={}, **kwargs):
+        key = self._lookup_key(name, attrs, kwargs)
+        if key in self._matches:
+            return list(self._matches[key])
+        return self.soup.find_all(name, attrs, **kwargs)
+
+    def find(self, name=None, attrs={}, **kwargs):
+        key = self._lookup_key(name, attrs, kwargs)
+        if key in self._matches:
+            matches = self._matches[key]
+            return matches[0] if matches else None
+        return self.soup.find(name, attrs, **kwargs)
+
+    def campaign_state(self):
+        # parsed once, every era reads the same dict
+        if self._campaign_state is None and self._campaign_state_error is None:
+            try:
+                self._campaign_state = _extract_window_initial_state_script(self)
+            except Exception as e:
+                self._campaign_state_error = e
+        if self._campaign_state_error is not None:
+            raise self._campaign_state_error
+        return self._campaign_state
+
 
 def extract_window_initial_state_script(soup):
-    script = soup.find('script',string=re.compile(r'window\.initialState = '))
+    if isinstance(soup, PageIndex):
+        return soup.campaign_state()
+    return _extract_window_initial_state_script(soup)
+
+
+def _extract_window_initial_state_script(soup):
+    script = soup.find('script',string=WINDOW_INITIAL_STATE_PATTERN)
     # script.string has the structure of the window.initialState = {.....} ;
     # need to remove "window.initialState =" and ";" at the end
     window_initial_state  = re.sub('(window\.initialState = |;$)','', script.string)
@@ -1012,3 +1242,33 @@ def scrape_url_2019(soup, url):
         row_encode = row
 
     return row_encode
+
+
+ERA_SCRAPERS = {
+    "2012": scrape_url_2012,
+    "2013": scrape_url_2013,
+    "2014": scrape_url_2014,
+    "2015": scrape_url_2015,
+    "2017": scrape_url_2017,
+    "2018": scrape_url_2018,
+    "2019": scrape_url_2019,
+}
+
+
+def era_selectors(years):
+    return [selector for year in years for selector in ERA_SELECTORS[year]]
+
+
+def scrape_url_eras(soup, url, years):
+    """ runs the scrapers of several eras over one page with a single tree walk,
+    returns {year: row} in the order of years. soup can be a BeautifulSoup page
+    or a PageIndex built for these years by parsers.parse_page """
+    if isinstance(soup, PageIndex):
+        page = soup
+    else:
+        page = PageIndex(soup, era_selectors(years))
+    result_dict = {}
+    for year in years:
+        with metrics.span(f"scrape_{year}", url):
+            result_dict[year] = ERA_SCRAPERS[year](page, url)
+    return result_dict
@@ -1,30 +1,134 @@
-import time
+import queue
+import threading
 from .utils import log_message as print
+from . import metrics as metrics
+from . import ratecontrol as ratecontrol
 import argparse
 from sys import platform
 from selenium import webdriver
-import random
 RETRY_MAX = 5  # times
 TIMEOUT = 150  # seconds
-SLEEP = 30  # seconds
+POOL_SIZE = 1  # browser sessions
+MAX_PAGES_PER_SESSION = 200  # pages rendered before a session is recycled
+CHECKOUT_POLL = 1  # seconds
 
 class AttrDict(dict):
     def __init__(self, *args, **kwargs):
         super(AttrDict, self).__init__(*args, **kwargs)
         self.__dict__ = self
 
+class BrowserSession(object):
+    """ One headless chrome instance checked out of a RendererContainer pool """
+
+    def __init__(self, headless=True):
+        options = webdriver.ChromeOptions()
+        if headless:
+            options.add_argument("--headless")
+            options.add_argument("--disable-gpu")
+        self.driver = webdriver.Chrome(options=options)
+        self.driver.set_page_load_timeout(TIMEOUT)
+        self.pages_rendered = 0
+
+    def is_alive(self):
+        try:
+            # raises once chrome is unreachable or the window was closed
+            self.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            print("[rendercontainer] failed to quit chrome session: " + str(e))
+
 class RendererContainer(object):
-    def __init__(self):
-        self.renderer = None
-        self.get_renderer()
+    """ Pool of warm browser sessions shared by every thread that renders.
+
+    Sessions are opened lazily up to pool_size, health checked on checkout,
+    and recycled after max_pages_per_session renders to cap memory growth.
+    """
+
+    def __init__(
+        self,
+        pool_size=POOL_SIZE,
+        max_pages_per_session=MAX_PAGES_PER_SESSION,
+        headless=True,
+    ):
+        self.pool_size = pool_size
+        self.max_pages_per_session = max_pages_per_session
+        self.headless = headless
+        # LIFO keeps the most recently used sessions busy and lets the rest idle
+        self._idle_sessions = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._n_sessions = 0
+
+    def _reserve_new_session(self):
+        with self._lock:
+            if self._n_sessions < self.pool_size:
+                self._n_sessions += 1
+                return True
+        return False
 
-    def get_renderer(self):
-        if self.renderer is None:
-            self.renderer = webdriver.Chrome()
-        return self.renderer
+    def _open_session(self):
+        print("[rendercontainer] start a new chrome session")
+        try:
+            session = BrowserSession(headless=self.headless)
+        except Exception:
+            with self._lock:
+                self._n_sessions -= 1
+            raise
+        print("[rendercontainer] finished starting new chrome session")
+        return session
 
-    def reinitiate_renderer(self):
-        self.renderer = webdriver.Chrome()
+    def _discard(self, session):
+        session.quit()
+        with self._lock:
+            self._n_sessions -= 1
+
+    def warm(self):
+        """ open sessions until the pool holds pool_size of them """
+        while self._reserve_new_session():
+            self._idle_sessions.put(self._open_session())
+
+    def checkout(self):
+        while True:
+            try:
+                session = self._idle_sessions.get_nowait()
+            except queue.Empty:
+                if self._reserve_new_session():
+                    return self._open_session()
+                try:
+                    session = self._idle_sessions.get(timeout=CHECKOUT_POLL)
+                except queue.Empty:
+                    # a session may have been discarded meanwhile, check again
+                    continue
+            if session.is_alive():
+                return session
+            print("[rendercontainer] chrome session failed health check")
+            self._discard(session)
+
+    def checkin(self, session):
+        if session.pages_rendered >= self.max_pages_per_session:
+            print(
+                f"[rendercontainer] recycling chrome session after "
+                f"{session.pages_rendered} pages"
+            )
+            self._discard(session)
+        elif self._n_sessions > self.pool_size:
+            # pool was shrunk while this session was checked out
+            self._discard(session)
+        else:
+            self._idle_sessions.put(session)
+
+    def close(self):
+        while True:
+            try:
+                session = self._idle_sessions.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(session)
 
     def render(self, url):
         retry = True
@@ -32,27 +136,35 @@ class RendererContainer(object):
         print(f"Requesting {url}")
         campaign_page  = AttrDict()
         campaign_page.url = url
+        host = ratecontrol.host_of(url)
         while retry:
+            session = None
             try:
-                time.sleep(random.randint(0,10))
-                self.renderer.get(url)
-                campaign_page.text = self.renderer.page_source
+                with metrics.span("render_wait", url):
+                    # paced per host, failures slow the host down for retries
+                    ratecontrol.CONTROLLER.reserve(host)
+                    session = self.checkout()
+                with metrics.span("render", url):
+                    session.driver.get(url)
+                    session.pages_rendered += 1
+                    campaign_page.text = session.driver.page_source
                 if campaign_page.text is None: raise Exception()
                 retry = False
+                ratecontrol.CONTROLLER.report(host, True)
+                self.checkin(session)
             except Exception as e:
                 err_msg = str(e)
-                if 'chrome not reachable' in err_msg or 'window was already closed' in err_msg:
-                    print("[rendercontainer] " + err_msg)
-                    print("[rendercontainer] start a new chrome session")
-                    self.reinitiate_renderer()
-                    print("[rendercontainer] finished starting new chrome session")
-                else:
-                    print("[rendercontainer] " + err_msg)
+                print("[rendercontainer] " + err_msg)
+                ratecontrol.CONTROLLER.report(host, False)
+                if session is not None:
+                    if 'chrome not reachable' in err_msg or 'window was already closed' in err_msg:
+                        self._discard(session)
+                    else:
+                        self.checkin(session)
 
                 if retry_count < RETRY_MAX:
                     retry = True
-                    print(f"[rendercontainer] sleep {SLEEP} secs before retrying request")
-                    time.sleep(SLEEP)
+                    print("[rendercontainer] retrying request")
                 else:
                     print(f"[rendercontainer] failed to request {retry_count} times")
                     retry = False
@@ -0,0 +1,175 @@
+import csv
+import os
+
+from .utils import log_message as print
+from . import scrapers as scrapers
+from . import checkpoint as checkpoint
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ModuleNotFoundError:
+    pa = ds = pq = None
+
+# columns of every scraped row, see ScrapeManager.scrape_tablerow
+OUTPUT_COLUMNS = [*scrapers.empty_row] + [
+    "archive_timestamp",
+    "query_url",
+    "gfm_url",
+    "wayback_status",
+]
+ROW_GROUP_SIZE = 500  # rows buffered per parquet part file
+CHECKPOINT_ROWS = 50  # csv rows written between two checkpoints
+
+
+class CSVSink(object):
+    """ Writes rows to one csv file, the original deploy output.
+
+    The output and the journal are fsynced once every checkpoint_rows rows
+    and on close, a crash costs scraping the rows since the last checkpoint
+    again.
+    """
+
+    extension = ".csv"
+
+    def __init__(self, save_fullpath, new, checkpoint_rows=CHECKPOINT_ROWS):
+        self.save_fullpath = save_fullpath
+        self.new = new
+        if new:
+            print(f"creating new outfile {save_fullpath}")
+            mode = "w"
+        else:
+            print(f"loading outfile {save_fullpath}")
+            mode = "a"
+        self.outfile = save_fullpath.open(mode=mode, encoding="utf-8", newline="")
+        self.writer = csv.writer(self.outfile)
+        self.n_written = 0
+        self.checkpoint_rows = checkpoint_rows
+        self.n_uncommitted = 0
+
+    def write(self, row):
+        if self.new and self.n_written == 0:
+            self.writer.writerow(row.keys())
+        self.writer.writerow(row.values())
+        self.n_written += 1
+
+    def commit(self, journal, index):
+        self.n_uncommitted += 1
+        if self.n_uncommitted >= self.checkpoint_rows:
+            checkpoint.commit_rows(self.outfile, journal, index)
+            self.n_uncommitted = 0
+
+    def close(self, journal=None, index=None):
+        if journal is not None and self.n_uncommitted > 0:
+            checkpoint.commit_rows(self.outfile, journal, index)
+            self.n_uncommitted = 0
+        self.outfile.close()
+
+    @staticmethod
+    def rollback(save_fullpath, journal):
+        return checkpoint.rollback_output(save_fullpath, journal)
+
+
+class ParquetSink(object):
+    """ Writes rows to a directory of parquet part files with a fixed schema
+    of string columns, each part holding one row group of ROW_GROUP_SIZE rows.
+
+    Parts are written whole and journaled with the number of parts on disk,
+    so resuming deletes any part past the checkpoint; buffered rows that never
+    made it into a part are scraped again.
+    """
+
+    extension = ".parquet"
+
+    def __init__(self, save_fullpath, new, row_group_size=ROW_GROUP_SIZE):
+        if pa is None:
+            raise ModuleNotFoundError(
+                "pyarrow is needed for parquet output, pip install pyarrow"
+            )
+        self.save_fullpath = save_fullpath
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([(column, pa.string()) for column in OUTPUT_COLUMNS])
+        if new:
+            print(f"creating new outfile {save_fullpath}")
+            save_fullpath.mkdir(exist_ok=True)
+            for part_fpath in self._part_fpaths(save_fullpath):
+                part_fpath.unlink()
+        else:
+            print(f"loading outfile {save_fullpath}")
+            save_fullpath.mkdir(exist_ok=True)
+        self.n_parts = len(self._part_fpaths(save_fullpath))
+        self.buffer = {column: [] for column in OUTPUT_COLUMNS}
+        self.n_buffered = 0
+
+    @staticmethod
+    def _part_fpaths(save_fullpath):
+        return sorted(save_fullpath.glob("part-*.parquet"))
+
+    def write(self, row):
+        for column in OUTPUT_COLUMNS:
+            value = row.get(column)
+            self.buffer[column].append(None if value is None else str(value))
+        self.n_buffered += 1
+
+    def _flush(self):
+        table = pa.Table.from_pydict(self.buffer, schema=self.schema)
+        part_fpath = self.save_fullpath / f"part-{self.n_parts:05d}.parquet"
+        tmp_fpath = part_fpath.with_suffix(".tmp")
+        pq.write_table(table, tmp_fpath, row_group_size=self.row_group_size)
+        with tmp_fpath.open(mode="rb") as part:
+            os.fsync(part.fileno())
+        tmp_fpath.replace(part_fpath)
+        self.n_parts += 1
+        self.buffer = {column: [] for column in OUTPUT_COLUMNS}
+        self.n_buffered = 0
+
+    def commit(self, journal, index):
+        if self.n_buffered >= self.row_group_size:
+            self._flush()
+            journal.record(index, self.n_parts)
+
+    def close(self, journal=None, index=None):
+        if self.n_buffered > 0:
+            self._flush()
+            if journal is not None:
+                journal.record(index, self.n_parts)
+
+    @classmethod
+    def rollback(cls, save_fullpath, journal):
+        last = journal.last()
+        if last is None:
+            return None
+        index, n_parts = last
+        for part_fpath in cls._part_fpaths(save_fullpath)[n_parts:]:
+            part_fpath.unlink()
+        return index
+
+
+SINKS = {"csv": CSVSink, "parquet": ParquetSink}
+
+
+def _read_parquet_parts(part_fpaths, columns):
+    if ds is None:
+        raise ModuleNotFoundError(
+            "pyarrow is needed for parquet output, pip install pyarrow"
+        )
+    schema = pa.schema([(column, pa.string()) for column in OUTPUT_COLUMNS])
+    dataset = ds.dataset(
+        [str(part_fpath) for part_fpath in part_fpaths], schema=schema, format="parquet"
+    )
+    return dataset.to_table(columns=columns).to_pandas()
+
+
+def read_parquet_output(savepath, columns=None):
+    """ reads every parquet output in savepath into one DataFrame, only
+    loading the given columns """
+    part_fpaths = sorted(
+        savepath.glob(f"*{ParquetSink.extension}/part-*.parquet"), key=str
+    )
+    return _read_parquet_parts(part_fpaths, columns)
+
+
+def read_parquet_outfile(save_fullpath, columns=None):
+    """ reads the rows of one parquet output, in the order they were written """
+    return _read_parquet_parts(ParquetSink._part_fpaths(save_fullpath), columns)
@@ -4,6 +4,15 @@ Created on Tue Sep  3 09:21:52 2019
 
 @author: ers2244
 """
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ModuleNotFoundError:
+    pa = pc = None
+
+GOFUNDME_URL = "http://www.gofundme.com/"
 
 
 def omit_by_start(x):
@@ -70,7 +79,73 @@ def first_char_weird(x):
             return True
 
 
+def _mask(bools):
+    return bools.to_numpy(zero_copy_only=False)
+
+
+def _scalar_mask(func, values):
+    return np.fromiter((func(x) for x in values), dtype=bool, count=len(values))
+
+
 def wayback_url_cleaning(wb_urls):
+    """ drops the urls that are not campaign pages and tidies their campaign
+    ids, with the same output as wayback_url_cleaning_apply.
+
+    Arrow string kernels decide every row they can over the whole table, the
+    few rows they can't (no url scheme, ids that may be numbers or hold a
+    "%") go through the scalar functions above. Rows are filtered once with
+    the combined mask. Falls back to wayback_url_cleaning_apply without
+    pyarrow.
+    """
+    if pc is None:
+        return wayback_url_cleaning_apply(wb_urls)
+    url_values = wb_urls.cleaned_url.astype(str).to_numpy(dtype=object)
+    # a missing id becomes "nan", which float() accepts like the NaN itself
+    id_values = wb_urls.cleaned_campaign_id.astype(str).to_numpy(dtype=object)
+    urls = pa.array(url_values, type=pa.string())
+    ids = pa.array(id_values, type=pa.string())
+    first_chars = pc.utf8_slice_codeunits(ids, 0, 1)
+
+    # omit_by_start, the first "//" of a url with a scheme is the scheme's
+    keep = _mask(
+        pc.or_(pc.starts_with(urls, "http://www"), pc.starts_with(urls, "https://www"))
+    )
+    no_scheme = ~_mask(
+        pc.or_(pc.starts_with(urls, "http://"), pc.starts_with(urls, "https://"))
+    )
+    keep[no_scheme] = ~_scalar_mask(omit_by_start, url_values[no_scheme])
+
+    # just_numbers, an id starting with a letter other than i and n (inf,
+    # infinity, nan) is never a number
+    maybe_number = ~_mask(pc.utf8_is_alpha(first_chars)) | _mask(
+        pc.is_in(first_chars, value_set=pa.array(["i", "I", "n", "N"]))
+    )
+    keep[maybe_number] &= ~_scalar_mask(just_numbers, id_values[maybe_number])
+
+    # period_start
+    keep &= ~_mask(pc.starts_with(ids, "."))
+
+    # cut_percent_front and remove_percent_within only touch ids with a "%"
+    has_percent = _mask(pc.match_substring(ids, "%"))
+    id_values[has_percent] = [
+        remove_percent_within(cut_percent_front(x)) for x in id_values[has_percent]
+    ]
+
+    # first_char_weird, ids starting with an ascii letter or digit are fine
+    recheck = ~_mask(pc.ascii_is_alnum(first_chars)) | has_percent
+    keep[recheck] &= _scalar_mask(
+        lambda x: x != "" and not first_char_weird(x), id_values[recheck]
+    )
+
+    new = wb_urls[keep].copy()
+    new["cleaned_campaign_id"] = id_values[keep]
+    new["cleaned_url"] = GOFUNDME_URL + new.cleaned_campaign_id
+    return new
+
+
+def wayback_url_cleaning_apply(wb_urls):
+    """ the original row by row cleaning, the reference for
+    wayback_url_cleaning """
     delete_b = wb_urls.cleaned_url.apply(omit_by_start)
     # print(delete_b.value_counts())
     new = wb_urls[~delete_b]
@@ -1,8 +1,10 @@
+import csv
 import datetime
 import gzip
-import shutil
+import threading
 import urllib.request
 import xml.etree.ElementTree as et
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import warnings
 
@@ -12,12 +14,28 @@ import numpy as np
 from .utils import log_message as print
 from . import urlcleaning as uclean
 from . import waybackinterface as wbi
+from . import cdxindex as cdxindex
+from . import campaignkeys as campaignkeys
 from . import utils as utils
 
 from .. import data_io
 
 GFM_SITEMAP_URL = "https://www.gofundme.com/sitemap.xml"
 SITEMAP_PARENTDIR = data_io.input_raw
+MAX_PAGES_IN_FLIGHT = 8  # concurrent wayback cdx page downloads
+MAX_PACKETS_IN_FLIGHT = 8  # concurrent sitemap packet downloads
+URL_WRITE_CHUNK = 10000  # urls buffered per packet before writing
+SITEMAP_NS = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+SITEMAP_DIR_PREFIX = "sitemap_"
+URL_TABLE_NAME = "gfm_urls.csv"
+# tables diff_url_table writes next to the url table
+DELTA_TABLE_NAMES = {
+    "added": "gfm_urls_added.csv",
+    "removed": "gfm_urls_removed.csv",
+    "changed": "gfm_urls_changed.csv",
+    "unchanged": "gfm_urls_unchanged.csv",
+    "to_scrape": "gfm_urls_to_scrape.csv",
+}
 
 
 class URLCollector(object):
@@ -32,6 +50,7 @@ class URLCollector(object):
         self.sitemap_store = sitemap_parentdir
         self.verbose = verbose
         self.use_tqdm = use_tqdm
+        self.MAX_PACKETS_IN_FLIGHT = MAX_PACKETS_IN_FLIGHT
 
     @property
     def use_tqdm(self):
@@ -87,90 +106,207 @@ class URLCollector(object):
             self.log("[URLCollector] site map is up-to-date; no need to download")
         return sitemap_directory, sitemap_path
 
-    def _unpack_sitemap(self, sitemap_directory):
-        dpath, fpath = self._load_sitemap(sitemap_directory)
-        gzs = []
-        tree = et.parse(fpath)
-        root = tree.getroot()
-        savepath = dpath / "packets"
-        if not savepath.exists():
-            self.log("[URLCollector] loading packets...")
-            savepath.mkdir()
-            if self.use_tqdm:
-                root = self.tqdm(root, total=len(root))
-            for sitemap in root:
-                sitemap_iter = sitemap.findall(
-                    "{http://www.sitemaps.org/schemas/sitemap/0.9}loc"
-                )
-                for gz in sitemap_iter:
-                    filename = gz.text.split("/")[-1]
-                    if filename == "sitemap_marketing.xml.gz":
-                        continue
-                    if self.use_tqdm:
-                        root.set_description("retrieved " + filename)
-                    else:
-                        self.log("---retrieved " + filename)
-                    filepath = savepath / filename
-                    urllib.request.urlretrieve(gz.text, str(filepath))
-                    gzs.append(filepath)
-        else:
-            self.log("[URLCollector] site map packets already exist; no need to unpack.")
-            gzs = [p for p in savepath.glob("*.gz") if p.is_file()]
-        return gzs
-
-    def _unzip_all_gzs(self, gzs):
-        unzipped = [(gz.parent / gz.stem) if gz.suffix == ".gz" else gz for gz in gzs]
-        iterr = zip(gzs, unzipped)
-        if self.use_tqdm:
-            iterr = self.tqdm(iterr, total=len(unzipped))
-        for gz, uz in iterr:
-            if self.use_tqdm:
-                iterr.set_description("[URLCollector] unzipping " + (gz.stem + gz.suffix))
-            if gz.suffix != ".gz":
-                continue
-            with gzip.open(str(gz), "r") as f_in, uz.open(mode="wb") as f_out:
-                shutil.copyfileobj(f_in, f_out)
-            # os.remove(gz)
-        return unzipped
-
-    def _read_urls_from_xml_file(self, filepath):
-        """This parses the xml files to get the available urls.
-        Checks for the subset that have the work 'cancer' in their url.
-        This is not a great filter, but works for the time being. """
+    def _list_packets(self, sitemap_directory):
+        """ returns the sources of all sitemap packets: local .gz files left by
+        earlier runs if there are any, otherwise the urls listed in the index """
+        packet_dir = sitemap_directory / "packets"
+        if packet_dir.exists():
+            self.log("[URLCollector] site map packets already exist; no need to download.")
+            return [p for p in packet_dir.glob("*.gz") if p.is_file()]
+        _, fpath = self._load_sitemap(sitemap_directory)
+        packets = []
+        for _, elem in et.iterparse(str(fpath)):
+            if elem.tag == SITEMAP_NS + "loc":
+                if elem.text.split("/")[-1] != "sitemap_marketing.xml.gz":
+                    packets.append(elem.text.strip())
+            elem.clear()
+        return packets
+
+    def _open_packet(self, packet):
+        if isinstance(packet, Path):
+            return gzip.open(str(packet), "rb")
+        # decompress while downloading, nothing touches the disk
+        return gzip.GzipFile(fileobj=urllib.request.urlopen(packet))
+
+    def _iter_packet_urls(self, stream):
+        """ parses <url> entries one at a time into (loc, lastmod) and drops
+        each once read, so memory does not grow with the size of the packet.
+        lastmod is "" when the sitemap leaves it out. """
+        root = None
+        for event, elem in et.iterparse(stream, events=("start", "end")):
+            if root is None:
+                root = elem
+            elif event == "end" and elem.tag == SITEMAP_NS + "url":
+                loc = elem.findtext(SITEMAP_NS + "loc")
+                if loc is not None:
+                    lastmod = elem.findtext(SITEMAP_NS + "lastmod") or ""
+                    yield loc.strip(), lastmod.strip()
+                root.clear()
+
+    def _stream_packet(self, packet, writer, write_lock):
+        name = packet.name if isinstance(packet, Path) else packet.split("/")[-1]
         if not self.use_tqdm:
-            self.log("parsing " + str(filepath.stem))
-        root = et.parse(filepath).getroot()
-        urls = [
-            loc.text
-            for _url in root
-            for loc in _url.findall("{http://www.sitemaps.org/schemas/sitemap/0.9}loc")
-        ]
-        df = pd.Series(urls).to_frame(name="url")
-        # self.log('testing: dataframe length=' + str(len(df)))
-        return df
+            self.log("---streaming " + name)
+        n_urls, chunk = 0, []
+        with self._open_packet(packet) as stream:
+            for url, lastmod in self._iter_packet_urls(stream):
+                chunk.append((url, lastmod))
+                if len(chunk) >= URL_WRITE_CHUNK:
+                    with write_lock:
+                        writer.writerows(chunk)
+                    n_urls += len(chunk)
+                    chunk = []
+        with write_lock:
+            writer.writerows(chunk)
+        return n_urls + len(chunk)
 
-    def create_url_table(self):
+    def create_url_table(self, return_table=True, delta=False):
         """This goes through the site map and tabulates all the available urls.
-        The 'cancer' condition is impleneted in read_urls_from_xml_file at the moment.
-        Should probably move it."""
-        today_sitemap_folder = "sitemap_" + datetime.datetime.now().strftime("%Y%m%d")
+        Packets are downloaded concurrently, decompressed and parsed as they
+        stream in, and their urls are appended to gfm_urls.csv as they are read.
+        With delta, the table is diffed against the previous collection and
+        only the campaigns to scrape are returned, see diff_url_table."""
+        today_sitemap_folder = SITEMAP_DIR_PREFIX + datetime.datetime.now().strftime(
+            "%Y%m%d"
+        )
         sitemap_directory = self.sitemap_store / today_sitemap_folder
-        tablepath = sitemap_directory / "gfm_urls.csv"
+        tablepath = sitemap_directory / URL_TABLE_NAME
         if not tablepath.parent.exists():
             tablepath.parent.mkdir(parents=True)
-        uz_filepaths = self._unzip_all_gzs(self._unpack_sitemap(sitemap_directory))
-        if self.use_tqdm:
-            uz_filepaths = self.tqdm(uz_filepaths, desc="parsing sitemap xml")
-        urls_df_l = []
-        for fp in uz_filepaths:
+        packets = self._list_packets(sitemap_directory)
+        self.log("[URLCollector] streaming {} packets".format(len(packets)))
+        # only a complete table gets the final name
+        tmp_tablepath = tablepath.with_suffix(".tmp")
+        write_lock = threading.Lock()
+        n_urls = 0
+        with tmp_tablepath.open(
+            mode="w", encoding="utf-8", newline=""
+        ) as outfile, ThreadPoolExecutor(
+            max_workers=self.MAX_PACKETS_IN_FLIGHT
+        ) as executor:
+            writer = csv.writer(outfile)
+            writer.writerow(["url", "lastmod"])
+            futures = [
+                executor.submit(self._stream_packet, packet, writer, write_lock)
+                for packet in packets
+            ]
+            future_iter = as_completed(futures)
             if self.use_tqdm:
-                uz_filepaths.set_description("[URLCollector] parsing " + str(fp.stem))
-            urls_df_l.append(self._read_urls_from_xml_file(fp))
-        urls_df = pd.concat(urls_df_l, ignore_index=True, sort=True)
-        self.log("[URLCollector] {} urls loaded successfully".format(urls_df.shape[0]))
-        urls_df.to_csv(tablepath, encoding="utf-8", index=False)
+                future_iter = self.tqdm(
+                    future_iter, total=len(futures), desc="[URLCollector] parsing"
+                )
+            for future in future_iter:
+                n_urls += future.result()
+        tmp_tablepath.replace(tablepath)
+        self.log("[URLCollector] {} urls loaded successfully".format(n_urls))
+        if delta:
+            return self.diff_url_table(tablepath, return_table=return_table)
+        if not return_table:
+            return tablepath, None
+        urls_df = pd.read_csv(tablepath, encoding="utf-8", dtype=str)
         return tablepath, urls_df
 
+    def _previous_url_table(self, tablepath):
+        """ url table of the latest collection before the one of tablepath """
+        sitemap_directory = tablepath.parent
+        previous = sorted(
+            directory
+            for directory in sitemap_directory.parent.glob(SITEMAP_DIR_PREFIX + "*")
+            if directory.name < sitemap_directory.name
+            and (directory / URL_TABLE_NAME).exists()
+        )
+        return previous[-1] / URL_TABLE_NAME if previous else None
+
+    @staticmethod
+    def _read_url_table(tablepath):
+        urls = pd.read_csv(tablepath, encoding="utf-8", dtype=str)
+        if "lastmod" not in urls.columns:
+            # collected before lastmod was kept
+            urls["lastmod"] = np.nan
+        # a campaign is compared by its id, pages without one by their url
+        campaign_ids = wbi.extract_campaign_ids(urls.url)
+        urls["campaign_id"] = campaign_ids.where(campaign_ids != "", urls.url)
+        return urls[["url", "lastmod", "campaign_id"]]
+
+    def diff_url_table(self, tablepath, previous_tablepath=None, return_table=True):
+        """ compares a url table with the one of the previous collection, or
+        previous_tablepath, and writes next to it the campaigns that were
+        added, removed, changed and unchanged since.
+
+        Campaigns are matched by campaign key. One whose <lastmod> differs
+        between the two collections changed, if either has no lastmod it is
+        taken as unchanged. Added and changed campaigns are also written to
+        gfm_urls_to_scrape.csv, laid out like master_urls_table.csv so it can
+        go straight to a ScrapeManager, leaving out pages without a campaign
+        id; its path and table are returned.
+        """
+        tablepath = utils.verify_pathtype(tablepath)
+        if previous_tablepath is None:
+            previous_tablepath = self._previous_url_table(tablepath)
+        current = self._read_url_table(tablepath)
+        if previous_tablepath is None:
+            self.log("[URLCollector] no previous url table, every url is added")
+            previous = current.iloc[:0]
+        else:
+            self.log(f"[URLCollector] diffing against {previous_tablepath}")
+            previous = self._read_url_table(previous_tablepath)
+        current_keys, previous_keys = campaignkeys.campaign_keys(
+            current.campaign_id, previous.campaign_id
+        )
+        current = current.assign(_key=current_keys).drop_duplicates("_key")
+        previous = previous.assign(_key=previous_keys).drop_duplicates("_key")
+
+        in_previous = current._key.isin(previous._key)
+        common = current[in_previous].merge(
+            previous[["_key", "lastmod"]],
+            on="_key",
+            how="left",
+            suffixes=("", "_previous"),
+        )
+        changed_b = (
+            common.lastmod.notna()
+            & common.lastmod_previous.notna()
+            & (common.lastmod != common.lastmod_previous)
+        )
+        delta = {
+            "added": current[~in_previous],
+            "removed": previous[~previous._key.isin(current._key)],
+            "changed": common[changed_b],
+            "unchanged": common[~changed_b],
+        }
+        delta = {
+            name: urls[["url", "lastmod", "campaign_id"]].reset_index(drop=True)
+            for name, urls in delta.items()
+        }
+        to_scrape = pd.concat(
+            [delta["added"], delta["changed"]], ignore_index=True, sort=False
+        )
+        campaign_ids = wbi.extract_campaign_ids(to_scrape.url)
+        # pages without a campaign id are diffed but have nothing to scrape
+        has_id = campaign_ids.notna() & (campaign_ids != "")
+        to_scrape, campaign_ids = to_scrape[has_id], campaign_ids[has_id]
+        delta["to_scrape"] = pd.DataFrame(
+            {
+                "original_url": to_scrape.url,
+                "campaign_id": campaign_ids,
+                "cleaned_url": to_scrape.url,
+                "cleaned_campaign_id": campaign_ids,
+                "lastmod": to_scrape.lastmod,
+            }
+        ).reset_index(drop=True)
+        self.log(
+            "[URLCollector] "
+            + ", ".join(
+                f"{len(urls)} {name.replace('_', ' ')}" for name, urls in delta.items()
+            )
+        )
+        for name, urls in delta.items():
+            urls.to_csv(
+                tablepath.parent / DELTA_TABLE_NAMES[name], encoding="utf-8", index=False
+            )
+        to_scrape_path = tablepath.parent / DELTA_TABLE_NAMES["to_scrape"]
+        return to_scrape_path, delta["to_scrape"] if return_table else None
+
 
 class WaybackURLCollector(object):
     def __init__(
@@ -182,7 +318,13 @@ class WaybackURLCollector(object):
             self.query_outputpath,
             self.url_outputpath,
         ) = self.create_savepaths(sitemap_parentdir)
+        self.page_outputpath = self.query_outputpath / "pages"
+        if not self.page_outputpath.exists():
+            self.page_outputpath.mkdir()
+        # pages listed here are on disk already and are skipped on reruns
+        self.page_manifest_path = self.page_outputpath / "completed_pages.txt"
         self.URLTABLE_BATCH_SIZE = 100
+        self.MAX_PAGES_IN_FLIGHT = MAX_PAGES_IN_FLIGHT
         self.MAX_WAYBACK_SEARCH_PAGE = wbi.get_max_search_page()
         self.start_year, self.end_year = start_year, end_year
 
@@ -234,17 +376,79 @@ class WaybackURLCollector(object):
         return wayback_header + domain_str + years_str + page_num_str
 
     def process_query(self, url_i):
-        return pd.read_csv(
-            url_i,
-            sep=" ",
-            header=None,
-            names=wbi.SEARCH_RESULT_HEADER,
-            encoding="utf-8",
+        try:
+            return pd.read_csv(
+                url_i,
+                sep=" ",
+                header=None,
+                names=wbi.SEARCH_RESULT_HEADER,
+                encoding="utf-8",
+            )
+        except pd.errors.EmptyDataError:
+            # a page with no captures is complete, not failed
+            return pd.DataFrame(columns=wbi.SEARCH_RESULT_HEADER)
+
+    def _page_fpath(self, ipage):
+        return self.page_outputpath / f"wayback_query_output_page{ipage}.csv"
+
+    def _read_page_manifest(self):
+        if not self.page_manifest_path.exists():
+            return set()
+        with self.page_manifest_path.open(encoding="utf-8") as manifest:
+            return {int(line) for line in manifest if line.strip()}
+
+    def _download_page(self, ipage):
+        print(f"[WaybackURLCollector] Querying page {ipage}")
+        query = self.domain_search_query(ipage)
+        df = wbi.pull_request(query, self.process_query, raise_on_failure=True)
+        # write under a temporary name so a crash never leaves a partial page
+        fpath = self._page_fpath(ipage)
+        tmp_fpath = fpath.with_suffix(".tmp")
+        df.to_csv(tmp_fpath, encoding="utf-8", index=False)
+        tmp_fpath.replace(fpath)
+
+    def download_pages(self):
+        """ downloads every cdx page not yet in the manifest, at most
+        MAX_PAGES_IN_FLIGHT at a time, and returns the set of completed pages """
+        completed = self._read_page_manifest()
+        pages = [
+            ipage
+            for ipage in range(self.MAX_WAYBACK_SEARCH_PAGE)
+            if ipage not in completed
+        ]
+        print(
+            f"[WaybackURLCollector] {len(completed)} pages already downloaded,"
+            + f" {len(pages)} to go"
         )
+        with self.page_manifest_path.open(
+            mode="a", encoding="utf-8"
+        ) as manifest, ThreadPoolExecutor(
+            max_workers=self.MAX_PAGES_IN_FLIGHT
+        ) as executor:
+            futures = {
+                executor.submit(self._download_page, ipage): ipage for ipage in pages
+            }
+            future_iter = as_completed(futures)
+            if self.use_tqdm:
+                future_iter = self.tqdm(
+                    future_iter, total=len(futures), desc="Downloading pages"
+                )
+            for future in future_iter:
+                ipage = futures[future]
+                try:
+                    future.result()
+                except Exception as ee:
+                    print(f"[WaybackURLCollector] Failed page {ipage}: {ee}")
+                    continue
+                manifest.write(f"{ipage}\n")
+                manifest.flush()
+                completed.add(ipage)
+        return completed
 
     def create_url_table(self, return_condensed=True):
         batch_size, max_page = self.URLTABLE_BATCH_SIZE, self.MAX_WAYBACK_SEARCH_PAGE
-        out_fpaths, url_fpaths = [], []
+        completed = self.download_pages()
+        url_fpaths = []
         output_fdir = self.query_outputpath
         for ibatch, batch in enumerate(
             np.split(
@@ -252,31 +456,58 @@ class WaybackURLCollector(object):
                 np.arange(batch_size, max_page, batch_size, dtype=np.uint32),
             )
         ):
-            df_l = []
-            for ipage in batch:
-                print(f"[WaybackURLCollector] Querying page {ipage}")
-                query = self.domain_search_query(ipage)
-                df_l.append(wbi.pull_request(query, self.process_query))
-            df_a = pd.concat(df_l, ignore_index=True, sort=True)
-            print(f"[WaybackURLCollector] Saving batch {ibatch}")
+            batch = [int(ipage) for ipage in batch]
+            n_missing = len([ipage for ipage in batch if ipage not in completed])
+            if n_missing > 0:
+                print(
+                    f"[WaybackURLCollector] Skipping batch {ibatch},"
+                    + f" {n_missing} pages failed to download; rerun to retry them"
+                )
+                continue
             output_fpath = output_fdir / f"wayback_query_output_batch{ibatch}.csv"
+            url_fpath = self.url_outputpath / f"wayback_urls_batch{ibatch}.csv"
+            if output_fpath.exists() and url_fpath.exists():
+                url_fpaths.append(url_fpath)
+                continue
+            df_a = pd.concat(
+                [
+                    pd.read_csv(self._page_fpath(ipage), encoding="utf-8", dtype=str)
+                    for ipage in batch
+                ],
+                ignore_index=True,
+                sort=True,
+            )
+            print(f"[WaybackURLCollector] Saving batch {ibatch}")
             df_a.to_csv(output_fpath, encoding="utf-8", index=False)
-            out_fpaths.append(output_fpath)
             # clean output to get url list
-            url_fpath_l = self.extract_urls_from_wayback_output([output_fpath])
-            url_fpaths += url_fpath_l
+            url_fpaths += self.extract_urls_from_wayback_output([output_fpath])
         # read all urls to get massive dataframe
         if return_condensed:
             return self.condense_url_batches(url_fpaths)
         else:
             return url_fpaths, None
 
+    def build_cdx_index(self, index_path=None):
+        """ compacts the query output batches into a cdx index that
+        ScrapeManager(cdx_index_path=...) searches before the wayback api """
+        batch_fpaths = sorted(
+            self.query_outputpath.glob("wayback_query_output_batch*.csv"),
+            key=lambda x: int(x.stem.replace("wayback_query_output_batch", "")),
+        )
+        if index_path is None:
+            index_path = self.savepath / cdxindex.INDEX_DIRNAME
+        return cdxindex.build_cdx_index(batch_fpaths, index_path)
+
     def condense_url_batches(self, url_fpaths):
         url_table = pd.concat(
             [pd.read_csv(ufp, encoding="utf-8") for ufp in url_fpaths],
             ignore_index=True,
             sort=False,
         )
+        # keep a campaign archived in the time range of several batches once
+        url_table = campaignkeys.drop_duplicate_campaigns(
+            url_table, "cleaned_campaign_id"
+        ).reset_index(drop=True)
         fout = self.savepath / "wayback_urls_all_batches.csv"
         print("[WaybackURLCollector] Saving {}".format(str(fout)))
         url_table.to_csv(fout, index=False)
@@ -334,6 +565,8 @@ class WaybackURLCollector(object):
 
 # Usage
 # tablepath,urls_df=URLCollector().create_url_table()
+# only the campaigns added or changed since the previous collection
+# to_scrape_path,to_scrape_df=URLCollector().create_url_table(delta=True)
 # wbcollector = WaybackURLCollector()
 # wbtablepath,wburls_df=wbcollector.create_url_table()
 # masterpath,master_df = wbcollector.compare_url_tables(urls_df,wburls_df)
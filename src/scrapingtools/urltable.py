@@ -0,0 +1,143 @@
+import json
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+from .utils import log_message as print
+from . import utils as utils
+
+TABLE_NAME = "urls"
+INDEX_COLUMN = "idx"  # row number in the csv, the index deploy works with
+BUILD_CHUNKSIZE = 100000  # csv rows read at a time while building
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+class URLTable(object):
+    """ A url table csv converted once into an sqlite database next to it.
+
+    Rows keep their csv row number as the primary key, so ranges of the table
+    are read straight off the key and campaign lookups use an index on
+    lower(column) built the first time a column is searched. Nothing is held
+    in memory beyond the rows of the current read. The database is rebuilt
+    whenever the csv changes.
+    """
+
+    def __init__(self, csv_path, db_path=None):
+        self.csv_path = utils.verify_pathtype(csv_path)
+        self.db_path = (
+            utils.verify_pathtype(db_path)
+            if db_path is not None
+            else self.csv_path.with_suffix(".sqlite")
+        )
+        if not self._is_current():
+            self._build()
+        with closing(self._connect()) as con:
+            table_info = con.execute(f"PRAGMA table_info({TABLE_NAME})").fetchall()
+            self.columns = [info[1] for info in table_info if info[1] != INDEX_COLUMN]
+            self.start, self.stop = con.execute(
+                f"SELECT COALESCE(MIN({INDEX_COLUMN}), 0),"
+                + f" COALESCE(MAX({INDEX_COLUMN}) + 1, 0) FROM {TABLE_NAME}"
+            ).fetchone()
+
+    def _connect(self):
+        # one connection per call, so any thread can read the table
+        return sqlite3.connect(str(self.db_path))
+
+    def _source_stamp(self):
+        stat = self.csv_path.stat()
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def _is_current(self):
+        if not self.db_path.exists():
+            return False
+        try:
+            with closing(self._connect()) as con:
+                (stamp,) = con.execute("SELECT stamp FROM source").fetchone()
+        except sqlite3.Error:
+            return False
+        return json.loads(stamp) == self._source_stamp()
+
+    def _build(self):
+        print(f"[URLTable] Building {self.db_path.name} from {self.csv_path.name}")
+        tmp_path = self.db_path.with_suffix(".sqlite.tmp")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        con = sqlite3.connect(str(tmp_path))
+        try:
+            chunks = pd.read_csv(
+                self.csv_path, encoding="utf-8", dtype=str, chunksize=BUILD_CHUNKSIZE
+            )
+            for ichunk, chunk in enumerate(chunks):
+                if ichunk == 0:
+                    columns = ", ".join(
+                        [f"{INDEX_COLUMN} INTEGER PRIMARY KEY"]
+                        + [f"{_quote(column)} TEXT" for column in chunk.columns]
+                    )
+                    con.execute(f"CREATE TABLE {TABLE_NAME} ({columns})")
+                chunk.to_sql(
+                    TABLE_NAME,
+                    con,
+                    if_exists="append",
+                    index=True,
+                    index_label=INDEX_COLUMN,
+                )
+            con.execute("CREATE TABLE source (stamp TEXT)")
+            con.execute(
+                "INSERT INTO source VALUES (?)", (json.dumps(self._source_stamp()),)
+            )
+            con.commit()
+        finally:
+            con.close()
+        tmp_path.replace(self.db_path)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def _read_sql(self, query, params=()):
+        with closing(self._connect()) as con:
+            return pd.read_sql_query(query, con, params=params, index_col=INDEX_COLUMN)
+
+    def read_range(self, start, stop):
+        """ rows with start <= index < stop """
+        return self._read_sql(
+            f"SELECT * FROM {TABLE_NAME}"
+            + f" WHERE {INDEX_COLUMN} >= ? AND {INDEX_COLUMN} < ?"
+            + f" ORDER BY {INDEX_COLUMN}",
+            (int(start), int(stop)),
+        )
+
+    def get_row(self, index):
+        rows = self.read_range(index, index + 1)
+        if rows.empty:
+            raise KeyError(index)
+        return rows.iloc[0, :]
+
+    def find_indices(self, column, value, case_sensitive=False):
+        """ indices of the rows where column equals value, ignoring case
+        unless case_sensitive (sqlite only folds ascii letters) """
+        if column not in self.columns:
+            raise ValueError(f"{column} is not a column of {self.csv_path}")
+        # closed when done, the inner with commits the index it may create
+        with closing(self._connect()) as con, con:
+            if case_sensitive:
+                con.execute(
+                    f"CREATE INDEX IF NOT EXISTS {_quote('by_' + column)}"
+                    + f" ON {TABLE_NAME} ({_quote(column)})"
+                )
+                where = f"{_quote(column)} = ?"
+            else:
+                con.execute(
+                    f"CREATE INDEX IF NOT EXISTS {_quote('by_lower_' + column)}"
+                    + f" ON {TABLE_NAME} (lower({_quote(column)}))"
+                )
+                where = f"lower({_quote(column)}) = lower(?)"
+            rows = con.execute(
+                f"SELECT {INDEX_COLUMN} FROM {TABLE_NAME} WHERE {where}"
+                + f" ORDER BY {INDEX_COLUMN}",
+                (value,),
+            ).fetchall()
+        return [row[0] for row in rows]
@@ -1,15 +1,29 @@
 import requests
+import numpy as np
 import pandas as pd
 import urllib.parse as up
-import time
+import argparse
+import os
 import re
+import time
+from collections import OrderedDict, deque
 from .utils import log_message as print
+from . import metrics as metrics
+from . import ratecontrol as ratecontrol
+from . import campaignkeys as campaignkeys
 from tqdm import tqdm
 from io import StringIO
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ModuleNotFoundError:
+    pa = pc = None
 
 RETRY_MAX = 10  # times
 TIMEOUT = 150  # seconds
-SLEEP = 60  # seconds
+WAYBACK_HOST = "web.archive.org"  # host every cdx search is paced against
 SEARCH_RESULT_HEADER = [
     "urlkey",
     "timestamp",
@@ -49,6 +63,14 @@ IMPORTANCE_MATRIX = pd.DataFrame.from_dict(
 )
 IMPORTANCE_MATRIX.index.name = "field"
 IMPORTANCE_MATRIX = IMPORTANCE_MATRIX["importance_score"]
+# plain python/numpy copies of IMPORTANCE_MATRIX for scoring without pandas
+IMPORTANCE_FIELDS = list(IMPORTANCE_MATRIX.index)
+IMPORTANCE_WEIGHTS = IMPORTANCE_MATRIX.to_numpy()
+_WEIGHTED_FIELDS = [
+    (field, int(weight))
+    for field, weight in zip(IMPORTANCE_FIELDS, IMPORTANCE_WEIGHTS)
+    if weight != 0
+]
 
 
 def get_max_search_page():
@@ -63,13 +85,18 @@ def get_max_search_page():
     return npage
 
 
-def pull_request(url_to_search, process_func, **kwargs):
+def pull_request(
+    url_to_search, process_func, raise_on_failure=False, host=WAYBACK_HOST, **kwargs
+):
     retry = True
     for retry_count in range(RETRY_MAX):
         if retry_count > 0:
             print(f"request try {retry_count+1}")
+        # retries are paced by the rate controller backing off the host
+        ratecontrol.CONTROLLER.reserve(host)
         try:
             results = process_func(url_to_search, **kwargs)
+            ratecontrol.CONTROLLER.report(host, True)
             if results.empty:
                 results = pd.DataFrame(columns=SEARCH_RESULT_HEADER)
             retry = False
@@ -77,11 +104,11 @@ def pull_request(url_to_search, process_func, **kwargs):
                 break
         except Exception as ee:
             print(f"returned error: {str(ee)}")
-            if retry_count < (RETRY_MAX - 1):
-                print(f"sleep {SLEEP} secs before retrying request")
-                time.sleep(SLEEP)
+            ratecontrol.CONTROLLER.report(host, False)
     if retry:
         print(f"failed to search {retry_count+1} times")
+        if raise_on_failure:
+            raise RuntimeError(f"failed to search {url_to_search}")
         results = pd.DataFrame(columns=SEARCH_RESULT_HEADER)
     return results
 
@@ -108,18 +135,60 @@ def _search_wayback(url_to_search, timeout=TIMEOUT):
 
 
 def search_wayback(url_to_search, timeout=TIMEOUT):
-    return pull_request(url_to_search, _search_wayback, timeout=timeout)
+    with metrics.span("wayback_search", url_to_search):
+        return pull_request(url_to_search, _search_wayback, timeout=timeout)
 
 
-def clean_wayback_search_results(queryoutput):
-    parsed_urls = queryoutput.original.apply(lambda x: up.urlsplit(x))
-    parsed_urls = pd.DataFrame.from_records(
-        parsed_urls,
+def _parse_search_results(queryoutput):
+    parsed_urls = pd.DataFrame(
+        [up.urlsplit(x) for x in queryoutput.original],
         columns=["_scheme", "_domain", "_path", "_query", "_fragment"],
-        index=parsed_urls.index,
-    ).join(queryoutput, how="left")
-    parsed_urls["unquote_path"] = parsed_urls._path.apply(lambda x: up.unquote(x))
-    parsed_urls["unquote_query"] = parsed_urls._query.apply(lambda x: up.unquote(x))
+        index=queryoutput.index,
+    )
+    parsed_urls = pd.concat([parsed_urls, queryoutput], axis=1)
+    parsed_urls["unquote_path"] = [up.unquote(x) for x in parsed_urls._path]
+    parsed_urls["unquote_query"] = [up.unquote(x) for x in parsed_urls._query]
+    return parsed_urls
+
+
+def _ranks(values):
+    # integer codes in sorted order of the values, missing values get -1
+    return pd.factorize(values, sort=True)[0]
+
+
+def clean_wayback_search_results(queryoutput, by=None):
+    """ keeps the captures of every url path with the smallest query, newest
+    first and ties in path order. Passing the name of a column as by cleans
+    the search results of many searches at once, each value of by on its own
+    and in the order of by. """
+    parsed_urls = _parse_search_results(queryoutput)
+    path_ranks = _ranks(parsed_urls.unquote_path)
+    query_ranks = _ranks(parsed_urls.unquote_query)
+    group_keys = [path_ranks]
+    sort_keys = [path_ranks, -_ranks(parsed_urls.timestamp)]
+    if by is not None:
+        by_ranks = _ranks(parsed_urls[by])
+        group_keys.append(by_ranks)
+        sort_keys.append(by_ranks)
+    # smallest query of every group, without building the groups
+    groups = np.unique(np.stack(group_keys, axis=1), axis=0, return_inverse=True)[1]
+    groups = groups.reshape(-1)
+    min_query = np.full(groups.max(initial=-1) + 1, query_ranks.size)
+    np.minimum.at(min_query, groups, query_ranks)
+    keep = query_ranks == min_query[groups]
+    # one stable sort, its last key sorts first
+    order = np.lexsort(sort_keys)
+    select_urls = parsed_urls.iloc[order[keep[order]]].reset_index(drop=True)
+    select_urls["original"] = (
+        select_urls["original"].astype(str).str.replace(":80", "", regex=False)
+    )
+    return select_urls
+
+
+def clean_wayback_search_results_apply(queryoutput):
+    """ the original groupby.apply version, the reference for
+    clean_wayback_search_results """
+    parsed_urls = _parse_search_results(queryoutput)
     select_urls = parsed_urls.groupby(by=["unquote_path"], as_index=False).apply(
         lambda df: df.loc[df.unquote_query == df.unquote_query.min(), :]
     )
@@ -132,23 +201,94 @@ def clean_wayback_search_results(queryoutput):
     return select_urls
 
 
+def _canonical_order(select_urls):
+    # the apply version leaves captures with the same timestamp unordered
+    return select_urls.sort_values(list(select_urls.columns)).reset_index(drop=True)
+
+
+def compare_cleaning(queryoutput):
+    """ True if clean_wayback_search_results keeps the same captures as
+    clean_wayback_search_results_apply """
+    select_urls = clean_wayback_search_results(queryoutput)
+    reference = clean_wayback_search_results_apply(queryoutput)
+    return _canonical_order(select_urls).equals(_canonical_order(reference))
+
+
+def time_cleaning(queryoutput, by, repeat=3):
+    """ seconds per run of cleaning every search in queryoutput: one search
+    per value of by cleaned one at a time with the apply version and with
+    clean_wayback_search_results, and all of them at once in batch mode """
+    searches = [search for _, search in queryoutput.groupby(by, sort=False)]
+    runs = {
+        "apply": lambda: [clean_wayback_search_results_apply(s) for s in searches],
+        "vectorized": lambda: [clean_wayback_search_results(s) for s in searches],
+        "batch": lambda: clean_wayback_search_results(queryoutput, by=by),
+    }
+    timings = {}
+    for name, run in runs.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            run()
+        timings[name] = (time.perf_counter() - start) / repeat
+    return timings
+
+
 def remove_port_from_url(url_str):
     return url_str.replace(":80", "")
 
 
 def filter_nonworking_search_results(search_results):
-    search_results = search_results[~(search_results.statuscode.isin(["301", "404"]))]
+    # redirects, errors and "-" revisit records never hold a campaign page
+    search_results = search_results[search_results.statuscode == "200"]
     return search_results
 
 
+def _bisection_order(n):
+    # newest, oldest, then the midpoints of ever smaller stretches of the
+    # timeline, so the first few probes already span all of it
+    if n == 0:
+        return []
+    order = [0] if n == 1 else [0, n - 1]
+    intervals = deque([(0, n - 1)])
+    while intervals:
+        lo, hi = intervals.popleft()
+        if hi - lo < 2:
+            continue
+        mid = (lo + hi) // 2
+        order.append(mid)
+        intervals.append((lo, mid))
+        intervals.append((mid, hi))
+    return order
+
+
+def plan_snapshot_probes(search_results, max_snapshots=None):
+    """ orders working snapshots in the order they should be scraped: drops
+    non-200 captures, keeps only the newest capture of each digest since
+    identical pages scrape identically, and spreads the probes across the
+    timeline by bisection instead of walking it from the newest """
+    search_results = filter_nonworking_search_results(search_results)
+    search_results = search_results.sort_values(
+        "timestamp", ascending=False, kind="mergesort"
+    )
+    search_results = search_results.drop_duplicates(subset="digest", keep="first")
+    probes = search_results.iloc[_bisection_order(search_results.shape[0])]
+    if max_snapshots is not None:
+        probes = probes.iloc[:max_snapshots]
+    return probes.reset_index(drop=True)
+
+
 def get_campaign_page(url_to_get, check_status_code=True):
     retry = True
     print(f"Requesting {url_to_get}")
+    host = ratecontrol.host_of(url_to_get)
     for retry_count in range(RETRY_MAX):
         if retry_count > 0:
             print(f"request try {retry_count+1}")
+        ratecontrol.CONTROLLER.reserve(host)
+        campaign_page = None
         try:
             campaign_page = requests.get(url_to_get)
+            ratecontrol.CONTROLLER.report_status(host, campaign_page.status_code)
             if check_status_code:
                 retry = campaign_page.status_code != 200
                 # 200 is http response code for success
@@ -160,9 +300,9 @@ def get_campaign_page(url_to_get, check_status_code=True):
                 break
         except Exception as ee:
             print(f"returned error: {ee}")
-            if retry_count < (RETRY_MAX - 1):
-                print(f"sleep {SLEEP} secs before retrying request")
-                time.sleep(SLEEP)
+            if campaign_page is None:
+                # no response at all, a bad status was already reported
+                ratecontrol.CONTROLLER.report(host, False)
     if retry:
         print(f"failed to request {retry_count+1} times")
         campaign_page = None
@@ -170,8 +310,18 @@ def get_campaign_page(url_to_get, check_status_code=True):
 
 
 def scrape_quality(row):
-    not_none = pd.Series(row) != "none"
-    return (not_none * IMPORTANCE_MATRIX).sum()
+    """ sum of the importance scores of the fields of row that are not "none" """
+    return sum(
+        weight for field, weight in _WEIGHTED_FIELDS if row.get(field, "none") != "none"
+    )
+
+
+def scrape_quality_batch(rows):
+    """ scrape_quality of every row of a DataFrame in one numpy operation """
+    scraped = (
+        rows.reindex(columns=IMPORTANCE_FIELDS, fill_value="none").to_numpy() != "none"
+    )
+    return pd.Series(scraped @ IMPORTANCE_WEIGHTS, index=rows.index)
 
 
 def timestamp_from_wayback_url(url_str):
@@ -232,6 +382,68 @@ def extract_campaign_id_from_gfm_url(x):
     return campaign_id
 
 
+def extract_campaign_ids(urls):
+    """ extract_campaign_id_from_gfm_url over a whole Series of urls """
+    paths = (
+        urls.astype(str)
+        .str.replace(r"^[a-zA-Z][a-zA-Z0-9+.-]*://[^/?#]*", "", regex=True)
+        .str.replace(r"[?#].*$", "", regex=True)
+    )
+    path_components = paths.str.split("/")
+    n_components = path_components.str.len()
+    has_f = paths.str.contains(r"(?:^|/)f(?:/|$)", regex=True)
+    campaign_ids = path_components.str.get(-1)
+    campaign_ids = campaign_ids.mask(
+        ~has_f & (n_components >= 2), path_components.str.get(1)
+    )
+    campaign_ids = campaign_ids.mask(
+        has_f & (n_components >= 3), path_components.str.get(2)
+    )
+    return campaign_ids
+
+
+def group_campaign_ids_by_prefix(campaign_ids, max_group_size, min_prefix_length):
+    """ groups campaign ids so that one cdx prefix query per group covers all
+    of them, returns {prefix: [campaign ids]}. Sorted ids are grouped greedily
+    as long as they share at least min_prefix_length leading characters. """
+    groups = OrderedDict()
+    prefix, group = None, []
+    for campaign_id in sorted(set(campaign_ids)):
+        common = os.path.commonprefix([prefix, campaign_id]) if group else ""
+        if group and len(common) >= min_prefix_length and len(group) < max_group_size:
+            prefix = common
+            group.append(campaign_id)
+            continue
+        if group:
+            groups.setdefault(prefix, []).extend(group)
+        prefix, group = campaign_id, [campaign_id]
+    if group:
+        groups.setdefault(prefix, []).extend(group)
+    return groups
+
+
+def index_search_results_by_campaign_id(search_results, campaign_ids):
+    """ splits search results into {campaign id: search results}, keeping only
+    the given (lowercased) campaign ids; ids without captures get an empty
+    frame so a lookup tells "never archived" apart from "not prefetched" """
+    campaign_ids = set(campaign_ids)
+    indexed = {}
+    if not search_results.empty:
+        result_ids = search_results.original.apply(
+            extract_campaign_id_from_gfm_url
+        ).str.lower()
+        in_block = result_ids.isin(campaign_ids)
+        for campaign_id, results in search_results[in_block].groupby(
+            result_ids[in_block], sort=False
+        ):
+            indexed[campaign_id] = results.sort_values(by="timestamp").reset_index(
+                drop=True
+            )
+    for campaign_id in campaign_ids - set(indexed):
+        indexed[campaign_id] = pd.DataFrame(columns=SEARCH_RESULT_HEADER)
+    return indexed
+
+
 def remove_special_char_in_beginning(x):
     if x == "":
         return x
@@ -269,7 +481,101 @@ def find_hidden_query_in_path(p):
     return p
 
 
+GOFUNDME_URL = "http://www.gofundme.com/"
+BAD_DOMAINS = [  # these domains dont contain campaign ids
+    "images.gofundme.com",
+    "support.gofundme.com",
+    "developer.gofundme.com",
+    "api.gofundme.com",
+    "email.gofundme.com",
+]
+# http(s) urls of printable ascii without the "[]" urlsplit validates, which
+# urlsplit splits plainly
+PLAIN_HTTP_URL = r"^[hH][tT][tT][pP][sS]?://[\x21-\x5a\x5c\x5e-\x7e]*$"
+# their netloc and first path segment
+URL_PARTS = r"^[^/]*//(?P<domain>[^/?#]*)(?:/(?P<campaign_id>[^/?#]*))?"
+
+
+def _campaign_id_from_path(path):
+    path_parts = path.split("/")[1:]
+    return path_parts[0] if len(path_parts) > 0 else ""
+
+
+def _clean_campaign_id(campaign_id):
+    campaign_id = remove_special_char_in_beginning(campaign_id)
+    campaign_id = find_hidden_query_in_path(campaign_id)
+    return remove_ending_period(campaign_id)
+
+
 def drop_duplicate_wayback_url(queryoutput, use_tqdm=True):
+    """ one row per cleaned campaign id of the wayback urls, with the same
+    output as drop_duplicate_wayback_url_apply.
+
+    Arrow regexes split the plain http(s) urls of printable ascii into domain
+    and campaign id, the rest goes through urlsplit. Ids only go through the
+    scalar cleaners when they could change, and the output frame is built
+    once from the kept rows, without list columns or joins. Falls back to
+    drop_duplicate_wayback_url_apply without pyarrow.
+    """
+    if pc is None:
+        return drop_duplicate_wayback_url_apply(queryoutput, use_tqdm)
+    originals = queryoutput.original.to_numpy(dtype=object)
+    urls = pa.array(originals, type=pa.string())
+    plain = pc.match_substring_regex(urls, PLAIN_HTTP_URL)
+    plain = pc.fill_null(plain, False).to_numpy(zero_copy_only=False)
+    parts = pc.extract_regex(urls, URL_PARTS)
+    domains = parts.field("domain")
+    bad = pc.is_in(
+        pc.utf8_lower(pc.replace_substring(domains, ":80", "")),
+        value_set=pa.array(BAD_DOMAINS),
+    )
+    bad = pc.fill_null(bad, False).to_numpy(zero_copy_only=False)
+    campaign_ids = parts.field("campaign_id")
+    # ids that start like a campaign name and hold no "&" or ending "."
+    # come out of the cleaners unchanged
+    unchanged = pc.and_(
+        pc.or_(
+            pc.ascii_is_alnum(pc.utf8_slice_codeunits(campaign_ids, 0, 1)),
+            pc.starts_with(campaign_ids, "-"),
+        ),
+        pc.invert(
+            pc.or_(
+                pc.match_substring(campaign_ids, "&"),
+                pc.ends_with(campaign_ids, "."),
+            )
+        ),
+    )
+    unchanged = pc.fill_null(unchanged, False).to_numpy(zero_copy_only=False)
+    campaign_ids = pc.fill_null(campaign_ids, "").to_numpy(zero_copy_only=False)
+
+    for irow in np.flatnonzero(~plain):
+        split = up.urlsplit(originals[irow])
+        bad[irow] = remove_port_from_url(split.netloc).lower().strip() in BAD_DOMAINS
+        campaign_ids[irow] = _campaign_id_from_path(split.path)
+        unchanged[irow] = False
+    cleaned_campaign_ids = campaign_ids.copy()
+    rows = np.flatnonzero(~unchanged)
+    cleaned_campaign_ids[rows] = [_clean_campaign_id(x) for x in campaign_ids[rows]]
+
+    keep = ~bad & (cleaned_campaign_ids != "")
+    rows = np.flatnonzero(keep)
+    rows = rows[~pd.Series(cleaned_campaign_ids[rows]).duplicated().to_numpy()]
+    campaign_ids = pd.Series(campaign_ids[rows])
+    cleaned_campaign_ids = pd.Series(cleaned_campaign_ids[rows])
+    return pd.DataFrame(
+        {
+            "parsed_url": GOFUNDME_URL + campaign_ids,
+            "campaign_id": campaign_ids,
+            "cleaned_url": GOFUNDME_URL + cleaned_campaign_ids,
+            "cleaned_campaign_id": cleaned_campaign_ids,
+            "original": originals[rows],
+        }
+    )
+
+
+def drop_duplicate_wayback_url_apply(queryoutput, use_tqdm=True):
+    """ the original row by row version, the reference for
+    drop_duplicate_wayback_url """
     parsed_urls = queryoutput.original.apply(lambda x: up.urlsplit(x))
     parsed_urls = pd.DataFrame.from_records(
         parsed_urls,
@@ -303,13 +609,7 @@ def drop_duplicate_wayback_url(queryoutput, use_tqdm=True):
         }
     )
 
-    bad_domains = [  # these domains dont contain campaign ids
-        "images.gofundme.com",
-        "support.gofundme.com",
-        "developer.gofundme.com",
-        "api.gofundme.com",
-        "email.gofundme.com",
-    ]
+    bad_domains = BAD_DOMAINS
     parsed_urls["_domain"] = (
         parsed_urls._domain.apply(remove_port_from_url).str.lower().str.strip()
     )
@@ -331,14 +631,35 @@ def drop_duplicate_wayback_url(queryoutput, use_tqdm=True):
 
 
 def compare_url_tables(gfm_urls, wb_urls):
-    gfm_urls = gfm_urls.copy()
+    # the url column, sitemap tables also have lastmod
+    gfm_urls = gfm_urls.iloc[:, :1].copy()
     gfm_urls.columns = ["original_url"]
-    gfm_urls["campaign_id"] = gfm_urls.original_url.apply(
-        extract_campaign_id_from_gfm_url
-    )
-    wb_only_urls = wb_urls[~wb_urls["cleaned_campaign_id"].isin(gfm_urls.campaign_id)]
+    gfm_urls["campaign_id"] = extract_campaign_ids(gfm_urls.original_url)
+    wb_only_urls = wb_urls[
+        ~campaignkeys.isin(wb_urls["cleaned_campaign_id"], gfm_urls.campaign_id)
+    ]
 
     gfm_urls["cleaned_url"] = gfm_urls.original_url
     gfm_urls["cleaned_campaign_id"] = gfm_urls.campaign_id
     master_table = pd.concat([gfm_urls, wb_only_urls], ignore_index=True, sort=False)
     return master_table, wb_only_urls
+
+
+if __name__ == "__main__":
+    # parity check and micro-benchmark of clean_wayback_search_results on a
+    # cdx query output, one search per campaign id
+    # python -m src.scrapingtools.waybackinterface path/to/query_output.csv
+    parser = argparse.ArgumentParser()
+    parser.add_argument("query_output", type=Path)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    queryoutput = pd.read_csv(args.query_output, dtype=str)
+    queryoutput["campaign_id"] = extract_campaign_ids(queryoutput.original).str.lower()
+    print(
+        f"{queryoutput.shape[0]} captures of"
+        + f" {queryoutput.campaign_id.nunique()} campaigns"
+    )
+    print(f"same captures kept: {compare_cleaning(queryoutput)}")
+    timings = time_cleaning(queryoutput, "campaign_id", repeat=args.repeat)
+    print(" ".join(f"{k}={v:.3f}s" for k, v in timings.items()))
@@ -0,0 +1,100 @@
+import re
+from pathlib import Path
+
+import pytest
+from bs4 import BeautifulSoup
+
+from src.scrapingtools import parsers, scrapers
+
+FIXTURE_DIR = Path(__file__).parent / "fixtures" / "html"
+# saved campaign pages named gfm_<era>.html, one per era scraper
+FIXTURES = sorted(FIXTURE_DIR.glob("gfm_*.html"))
+YEARS = list(scrapers.ERA_SCRAPERS)
+
+
+def _era(fixture):
+    return fixture.stem.split("_")[-1]
+
+
+def _scrape(html, url, backend):
+    page = parsers.parse_page(html, YEARS, backend)
+    return scrapers.scrape_url_eras(page, url, YEARS)
+
+
+def test_every_era_has_a_fixture():
+    assert {_era(fixture) for fixture in FIXTURES} >= set(YEARS)
+
+
+@pytest.mark.parametrize("fixture", FIXTURES, ids=lambda fixture: fixture.name)
+def test_backends_scrape_identical_fields(fixture):
+    html = fixture.read_text(encoding="utf-8")
+    expected = _scrape(html, fixture.stem, "bs4")
+    for backend in parsers.PARSER_BACKENDS[1:]:
+        assert _scrape(html, fixture.stem, backend) == expected
+    assert parsers.compare_backends(html, fixture.stem) == []
+
+
+@pytest.mark.parametrize("fixture", FIXTURES, ids=lambda fixture: fixture.name)
+def test_fixture_exercises_its_era(fixture):
+    # a fixture the era scraper finds nothing in would pass the parity test
+    # without checking anything
+    html = fixture.read_text(encoding="utf-8")
+    row = _scrape(html, fixture.stem, "bs4")[_era(fixture)]
+    for field in ("title", "story", "created_date", "last_donation_time", "tag"):
+        assert row[field] != "none", field
+
+
+HTML = """<html><head><title>t</title></head><body>
+<div id="a" class="x y">
+  <p class="y">Hello <b>bold</b> tail</p>
+  <p>Hello</p>
+  <!-- Hello comment -->
+  <span data-k="v">Hello</span>
+  <pre>
+  </pre>
+  <script>var s = "Hello";</script>
+</div>
+<p class="x">World</p>
+</body></html>"""
+
+FIND_ALL_CASES = [
+    {"name": "p"},
+    {"name": "p", "limit": 1},
+    {"name": ["p", "span"]},
+    {"name": re.compile("^s")},
+    {"name": True, "attrs": {"data-k": True}},
+    {"name": "p", "attrs": {"class": None}},
+    {"class_": "y"},
+    {"name": "p", "class_": re.compile("x")},
+    {"id": "a"},
+    {"name": "p", "string": "Hello"},
+    {"name": "p", "string": re.compile("Hel")},
+    {"string": re.compile("Hello")},
+    {"string": True},
+]
+
+
+def _describe(results):
+    # text nodes as they are, tags by name, class and text
+    return [
+        result
+        if isinstance(result, str)
+        else (result.name, result.get("class"), result.text)
+        for result in results
+    ]
+
+
+@pytest.mark.parametrize("kwargs", FIND_ALL_CASES, ids=repr)
+def test_lxml_find_all_matches_bs4(kwargs):
+    soup = BeautifulSoup(HTML, features="lxml")
+    page = parsers.LxmlPageIndex(HTML, []).soup
+    assert _describe(page.find_all(**kwargs)) == _describe(soup.find_all(**kwargs))
+
+
+@pytest.mark.parametrize("kwargs", [{"name": "p"}, {"string": True}], ids=repr)
+def test_lxml_find_all_not_recursive_matches_bs4(kwargs):
+    soup = BeautifulSoup(HTML, features="lxml").find("div")
+    page = parsers.LxmlPageIndex(HTML, []).soup.find("div")
+    assert _describe(page.find_all(recursive=False, **kwargs)) == _describe(
+        soup.find_all(recursive=False, **kwargs)
+    )
@@ -0,0 +1,49 @@
+from pathlib import Path
+
+import pytest
+
+from src.scrapingtools import scrapers
+
+FIXTURE_DIR = Path(__file__).parent / "fixtures" / "html"
+# saved pages and the status they have to get
+STATUS_FIXTURES = {
+    # every marker phrase in scripts, styles, comments and attributes only
+    "status_active_bundle.html": scrapers.PageStatus.ACTIVE,
+    "status_inactive.html": scrapers.PageStatus.INACTIVE,
+    "status_not_found.html": scrapers.PageStatus.NOT_FOUND,
+}
+
+
+@pytest.mark.parametrize("name", sorted(STATUS_FIXTURES))
+def test_page_status(name):
+    html = (FIXTURE_DIR / name).read_text(encoding="utf-8")
+    assert scrapers.page_status(html) is STATUS_FIXTURES[name]
+
+
+@pytest.mark.parametrize(
+    "fixture", sorted(FIXTURE_DIR.glob("gfm_*.html")), ids=lambda fixture: fixture.name
+)
+def test_era_pages_are_active(fixture):
+    html = fixture.read_text(encoding="utf-8")
+    assert scrapers.page_status(html) is scrapers.PageStatus.ACTIVE
+
+
+@pytest.mark.parametrize(
+    "html, expected",
+    [
+        ("<p>Campaign Not Found</p>", scrapers.PageStatus.NOT_FOUND),
+        ("<P>campaign not found</P>", scrapers.PageStatus.NOT_FOUND),
+        (
+            "<p>Campaign Not Found</p><div>currently disabled new donations</div>",
+            scrapers.PageStatus.INACTIVE,
+        ),
+        ("<SCRIPT>'Campaign Not Found'</SCRIPT>", scrapers.PageStatus.ACTIVE),
+        ("<script\n>'Campaign Not Found'</script >", scrapers.PageStatus.ACTIVE),
+        ("<!--\nCampaign Not Found\n-->", scrapers.PageStatus.ACTIVE),
+        ('<img alt="Campaign Not Found">', scrapers.PageStatus.ACTIVE),
+        ("<p>Campaign <b>Not Found</b></p>", scrapers.PageStatus.ACTIVE),
+        ("", scrapers.PageStatus.ACTIVE),
+    ],
+)
+def test_page_status_markup(html, expected):
+    assert scrapers.page_status(html) is expected
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.scrapingtools import urlcleaning as uclean
+
+# (cleaned_url, cleaned_campaign_id) pairs covering every branch of the
+# scalar cleaners, as drop_duplicate_wayback_url leaves them
+ROWS = [
+    ("http://www.gofundme.com/abc", "abc"),
+    ("https://www.gofundme.com/Abc-Def", "Abc-Def"),
+    ("http://gofundme.com/no-www", "no-www"),
+    ("https://gofundme.com/no-www-https", "no-www-https"),
+    ("gofundme.com/no-scheme", "no-scheme"),
+    ("www.gofundme.com/no-scheme-www", "no-scheme-www"),
+    ("//www.gofundme.com/protocol-relative", "protocol-relative"),
+    ("http://www.gofundme.com/nan", np.nan),
+    ("http://www.gofundme.com/12345", "12345"),
+    ("http://www.gofundme.com/1e5", "1e5"),
+    ("http://www.gofundme.com/12ab", "12ab"),
+    ("http://www.gofundme.com/inf", "inf"),
+    ("http://www.gofundme.com/Infinity", "Infinity"),
+    ("http://www.gofundme.com/NaN", "NaN"),
+    ("http://www.gofundme.com/nancy-fund", "nancy-fund"),
+    ("http://www.gofundme.com/.hidden", ".hidden"),
+    ("http://www.gofundme.com/-dash", "-dash"),
+    ("http://www.gofundme.com/_under", "_under"),
+    ("http://www.gofundme.com/!bang", "!bang"),
+    ("http://www.gofundme.com/éclair", "éclair"),
+    ("http://www.gofundme.com/ñandu", "ñandu"),
+    ("http://www.gofundme.com/abc&rcid=1", "abc&rcid=1"),
+    ("http://www.gofundme.com/abc&pc=fb&cache=1", "abc&pc=fb&cache=1"),
+    ("http://www.gofundme.com/&rcid=1", "&rcid=1"),
+    ("http://www.gofundme.com/abc%20def", "abc%20def"),
+    ("http://www.gofundme.com/%E2%80%8Babc", "%E2%80%8Babc"),
+    ("http://www.gofundme.com/%22abc%22", "%22abc%22"),
+    ("http://www.gofundme.com/%20abc%08", "%20abc%08"),
+    ("http://www.gofundme.com/%2Dabc", "%2Dabc"),
+    ("http://www.gofundme.com/%25x", "%25x"),
+    ("http://www.gofundme.com/a.b.", "a.b."),
+]
+
+
+def _wb_urls(rows):
+    cleaned_urls, cleaned_campaign_ids = zip(*rows)
+    return pd.DataFrame(
+        {
+            "parsed_url": list(cleaned_urls),
+            "campaign_id": list(cleaned_campaign_ids),
+            "cleaned_url": list(cleaned_urls),
+            "cleaned_campaign_id": list(cleaned_campaign_ids),
+            "original": list(cleaned_urls),
+        },
+        # the cleaning keeps the index of the rows it keeps
+        index=np.arange(len(rows)) * 3 + 7,
+    )
+
+
+@pytest.mark.skipif(uclean.pc is None, reason="needs pyarrow")
+def test_wayback_url_cleaning_matches_apply():
+    wb_urls = _wb_urls(ROWS)
+    expected = uclean.wayback_url_cleaning_apply(wb_urls.copy())
+    cleaned = uclean.wayback_url_cleaning(wb_urls.copy())
+    pd.testing.assert_frame_equal(cleaned, expected)
+    # the cases above have to keep and drop rows for the check to mean much
+    assert 0 < cleaned.shape[0] < wb_urls.shape[0]
+
+
+def test_wayback_url_cleaning_without_pyarrow(monkeypatch):
+    monkeypatch.setattr(uclean, "pc", None)
+    wb_urls = _wb_urls(ROWS)
+    pd.testing.assert_frame_equal(
+        uclean.wayback_url_cleaning(wb_urls.copy()),
+        uclean.wayback_url_cleaning_apply(wb_urls.copy()),
+    )
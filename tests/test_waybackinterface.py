@@ -0,0 +1,142 @@
+import pandas as pd
+import pytest
+
+from src.scrapingtools import waybackinterface as wbi
+
+# capture urls of a cdx dump covering the plain http(s) urls the arrow
+# regexes split and the ones left to urlsplit
+ORIGINALS = [
+    "http://www.gofundme.com/abc",
+    "https://www.gofundme.com/abc",
+    "http://www.gofundme.com:80/port",
+    "http://WWW.GOFUNDME.COM/Upper-Case",
+    "http://www.gofundme.com/f/with-f",
+    "http://www.gofundme.com/sub/path?x=1#frag",
+    "http://www.gofundme.com/query?pc=fb",
+    "http://www.gofundme.com/frag#top",
+    "http://www.gofundme.com/",
+    "http://www.gofundme.com",
+    "http://www.gofundme.com/?q=home",
+    "http://images.gofundme.com/img.png",
+    "http://IMAGES.gofundme.com:80/img2.png",
+    "https://support.gofundme.com/hc/en-us",
+    "http://api.gofundme.com/v1",
+    "http://www.gofundme.com/amp&rcid=1",
+    "http://www.gofundme.com/amp&pc=fb&cache=1",
+    "http://www.gofundme.com/&rcid=2",
+    "http://www.gofundme.com/ends.",
+    "http://www.gofundme.com/-dash",
+    "http://www.gofundme.com/_under",
+    "http://www.gofundme.com/!bang",
+    "http://www.gofundme.com/.dot",
+    "http://www.gofundme.com/%20space",
+    "http://www.gofundme.com/%E2%80%8Bzwsp",
+    "http://www.gofundme.com/%2Ddash",
+    "http://www.gofundme.com/é-accent",
+    "http://www.gofundme.com/[brackets]",
+    "http://www.gofundme.com/with space",
+    "HTTP://www.gofundme.com/upper-scheme",
+    "ftp://www.gofundme.com/ftp",
+    "gofundme.com/no-scheme",
+    "http://www.gofundme.com/abc",
+    "http://www.gofundme.com/ABC",
+    "http://www.gofundme.com/amp",
+]
+
+
+def _queryoutput(originals):
+    return pd.DataFrame(
+        {
+            "urlkey": "com,gofundme)/",
+            "timestamp": [str(20150101000000 + i) for i in range(len(originals))],
+            "original": originals,
+            "statuscode": "200",
+        }
+    )
+
+
+@pytest.mark.skipif(wbi.pc is None, reason="needs pyarrow")
+def test_drop_duplicate_wayback_url_matches_apply():
+    queryoutput = _queryoutput(ORIGINALS)
+    expected = wbi.drop_duplicate_wayback_url_apply(queryoutput, use_tqdm=False)
+    unique_urls = wbi.drop_duplicate_wayback_url(queryoutput, use_tqdm=False)
+    pd.testing.assert_frame_equal(unique_urls, expected)
+    assert 0 < unique_urls.shape[0] < queryoutput.shape[0]
+
+
+@pytest.mark.skipif(wbi.pc is None, reason="needs pyarrow")
+@pytest.mark.parametrize("original", ORIGINALS)
+def test_drop_duplicate_wayback_url_matches_apply_per_url(original):
+    queryoutput = _queryoutput([original])
+    expected = wbi.drop_duplicate_wayback_url_apply(queryoutput, use_tqdm=False)
+    pd.testing.assert_frame_equal(
+        wbi.drop_duplicate_wayback_url(queryoutput, use_tqdm=False),
+        expected,
+    )
+
+
+def test_drop_duplicate_wayback_url_without_pyarrow(monkeypatch):
+    monkeypatch.setattr(wbi, "pc", None)
+    queryoutput = _queryoutput(ORIGINALS)
+    pd.testing.assert_frame_equal(
+        wbi.drop_duplicate_wayback_url(queryoutput, use_tqdm=False),
+        wbi.drop_duplicate_wayback_url_apply(queryoutput, use_tqdm=False),
+    )
+
+
+def _search_results():
+    # captures of three searches, with several queries per path, repeated
+    # timestamps and the ":80" urls the cleaning strips
+    rows = [
+        ("abc", "20150101000000", "http://www.gofundme.com/abc"),
+        ("abc", "20160101000000", "http://www.gofundme.com/abc?pc=fb"),
+        ("abc", "20140101000000", "http://www.gofundme.com:80/abc"),
+        ("abc", "20170101000000", "http://www.gofundme.com/abc/updates"),
+        ("abc", "20170101000000", "http://www.gofundme.com/abc/donations"),
+        ("abc", "20130101000000", "http://www.gofundme.com/abc/updates?p=2"),
+        ("xyz", "20120101000000", "http://www.gofundme.com/f/xyz?a=1"),
+        ("xyz", "20190101000000", "http://www.gofundme.com/f/xyz?b=2"),
+        ("xyz", "20180101000000", "http://www.gofundme.com/f/xyz?a=1"),
+        ("xyz", "20180101000000", "http://www.gofundme.com/xyz%20"),
+        ("mno", "20150505000000", "https://www.gofundme.com/mno"),
+        ("mno", "20150505000000", "https://www.gofundme.com/mno#top"),
+        ("mno", "20110101000000", "https://www.gofundme.com/mno"),
+    ]
+    search_results = pd.DataFrame(
+        rows, columns=["campaign_id", "timestamp", "original"]
+    )
+    search_results["statuscode"] = "200"
+    search_results["digest"] = [f"D{i}" for i in range(len(rows))]
+    return search_results
+
+
+@pytest.mark.parametrize("campaign_id", [None, "abc", "xyz", "mno"])
+def test_clean_wayback_search_results_matches_apply(campaign_id):
+    search_results = _search_results()
+    if campaign_id is not None:
+        search_results = search_results[search_results.campaign_id == campaign_id]
+    assert wbi.compare_cleaning(search_results.reset_index(drop=True))
+
+
+def test_clean_wayback_search_results_newest_first():
+    search_results = _search_results()
+    for _, search in search_results.groupby("campaign_id"):
+        select_urls = wbi.clean_wayback_search_results(search)
+        timestamps = select_urls.timestamp.astype(int)
+        assert timestamps.is_monotonic_decreasing
+        assert not select_urls.original.str.contains(":80").any()
+
+
+def test_clean_wayback_search_results_batch_matches_per_search():
+    search_results = _search_results().sample(frac=1, random_state=0)
+    batch = wbi.clean_wayback_search_results(search_results, by="campaign_id")
+    expected = pd.concat(
+        [
+            wbi.clean_wayback_search_results(search)
+            for _, search in search_results.groupby("campaign_id", sort=True)
+        ],
+        ignore_index=True,
+    )
+    pd.testing.assert_frame_equal(batch, expected)
+    for _, select_urls in batch.groupby("campaign_id", sort=False):
+        assert select_urls.timestamp.astype(int).is_monotonic_decreasing